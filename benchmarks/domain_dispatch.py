@@ -0,0 +1,78 @@
+"""Compare the compiled domain dispatcher against the loop BotEvents used to run
+
+Run from the root of the repository:
+    python -m benchmarks.domain_dispatch
+"""
+import re
+import timeit
+
+from koabot.utils.urls import DomainDispatcher
+
+# Shaped like the match groups of the config
+MATCH_GROUPS = {
+    'danbooru': [{'url': 'danbooru.donmai.us', 'guide': [{'type': 'gallery', 'name': 'danbooru'}]},
+                 {'url': '*.donmai.us', 'guide': [{'type': 'gallery', 'name': 'danbooru'}]}],
+    'e621': [{'url': 'e621.net', 'guide': [{'type': 'gallery', 'name': 'e621'}]},
+             {'url': 'e926.net', 'guide': [{'type': 'gallery', 'name': 'e621'}]}],
+    'sankaku': [{'url': 'chan.sankakucomplex.com', 'guide': [{'type': 'gallery', 'name': 'sankaku'}]}],
+    'pixiv': [{'url': 'www.pixiv.net', 'guide': [{'type': 'gallery', 'name': 'pixiv'}]},
+              {'url': 'pixiv.net', 'guide': [{'type': 'gallery', 'name': 'pixiv'}]}],
+    'twitter': [{'url': 'twitter.com', 'guide': [{'type': 'gallery', 'name': 'twitter'}]},
+                {'url': 'mobile.twitter.com', 'guide': [{'type': 'gallery', 'name': 'twitter'}]}],
+    'deviantart': [{'url': 'www.deviantart.com', 'guide': [{'type': 'gallery', 'name': 'deviantart'}]},
+                   {'url': '*.deviantart.com', 'guide': [{'type': 'gallery', 'name': 'deviantart'}]}],
+    'imgur': [{'url': 'imgur.com', 'guide': [{'type': 'gallery', 'name': 'imgur'}]},
+              {'url': 'i.imgur.com', 'guide': [{'type': 'gallery', 'name': 'imgur'}]}],
+    'picarto': [{'url': 'picarto.tv', 'guide': [{'type': 'stream', 'name': 'picarto'}]},
+                {'url': 'www.picarto.tv', 'guide': [{'type': 'stream', 'name': 'picarto'}]}],
+}
+
+# A mix of hits, late hits and misses
+DOMAINS = [
+    'danbooru.donmai.us', 'safebooru.donmai.us', 'e621.net', 'www.pixiv.net', 'twitter.com',
+    'fav.me', 'www.youtube.com', 'picarto.tv', 'i.imgur.com', 'en.wikipedia.org',
+    'www.deviantart.com', 'artist.deviantart.com', 'github.com', 'cdn.discordapp.com',
+]
+
+
+def build_valid_urls(match_groups: dict):
+    """The list BotEvents.__init__ used to build"""
+    valid_urls = []
+    for group, contents in match_groups.items():
+        for match in contents:
+            url_pattern = match['url']
+            url_pattern = url_pattern.replace('.', r'\.')
+            url_pattern = url_pattern.replace('*', '(.*?)')
+            valid_urls.append({'group': group, 'url': url_pattern, 'guide': match['guide']})
+
+    return valid_urls
+
+
+def resolve_with_loop(valid_urls: list, fqdn: str):
+    """The lookup on_message used to run for every url"""
+    for valid_url in valid_urls:
+        if re.match(valid_url['url'], fqdn):
+            return (valid_url['group'], valid_url['guide'])
+
+    return None
+
+
+def main():
+    valid_urls = build_valid_urls(MATCH_GROUPS)
+    dispatcher = DomainDispatcher(MATCH_GROUPS)
+
+    for fqdn in DOMAINS:
+        assert resolve_with_loop(valid_urls, fqdn) == dispatcher.resolve(fqdn), fqdn
+
+    runs = 2000
+    loop_time = min(timeit.repeat(lambda: [resolve_with_loop(valid_urls, fqdn) for fqdn in DOMAINS], number=runs, repeat=5))
+    dispatcher_time = min(timeit.repeat(lambda: [dispatcher.resolve(fqdn) for fqdn in DOMAINS], number=runs, repeat=5))
+    lookups = runs * len(DOMAINS)
+
+    print(f'{lookups} lookups over {len(valid_urls)} patterns')
+    print(f'loop:       {loop_time / lookups * 1e6:8.3f}us per lookup')
+    print(f'dispatcher: {dispatcher_time / lookups * 1e6:8.3f}us per lookup ({loop_time / dispatcher_time:0.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
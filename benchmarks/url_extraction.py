@@ -0,0 +1,95 @@
+"""Compare the finditer url extractor against the per character scan on_message used to run
+
+Run from the root of the repository:
+    python -m benchmarks.url_extraction
+"""
+import random
+import timeit
+
+from koabot.patterns import URL_PATTERN
+from koabot.utils.urls import extract_urls
+
+URLS = [
+    'https://danbooru.donmai.us/posts/4012345',
+    'https://danbooru.donmai.us/posts?tags=koakuma+rating%3Asafe',
+    'https://e621.net/posts/2345678?q=order:score',
+    'https://www.pixiv.net/en/artworks/87654321',
+    'https://twitter.com/someartist/status/1357924680135792468',
+    'https://i.imgur.com/abcdEFG.png',
+    'https://picarto.tv/somestreamer',
+    'http://example.com/a_(b)/c,d;e=f&g=h',
+    'https://en.wikipedia.org/wiki/Touhou_Project#Characters',
+]
+
+WORDS = ['look', 'at', 'this', 'one', 'lol', 'same', 'artist', 'also', '<3', ':)', 'wait', 'what', 'koakuma', '~', 'https', 'http:']
+
+
+def make_message(rng: random.Random, parts: int):
+    """Put together a chatty message full of links, some of them escaped"""
+    pieces = []
+
+    for _ in range(parts):
+        roll = rng.random()
+
+        if roll < 0.3:
+            pieces.append(rng.choice(URLS))
+        elif roll < 0.4:
+            pieces.append(f'<{rng.choice(URLS)}>')
+        elif roll < 0.45:
+            # unclosed escapes and urls stuck to punctuation
+            pieces.append(rng.choice(['<', '(', '"']) + rng.choice(URLS) + rng.choice(['', ')', '"', '<', '>']))
+        else:
+            pieces.append(rng.choice(WORDS))
+
+    return rng.choice(['', '!']) + rng.choice([' ', '\n', '']).join(pieces)
+
+
+def make_corpus(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [make_message(rng, rng.randint(5, 400)) for _ in range(size)]
+
+
+def extract_with_scan(content: str):
+    """The loop on_message used to run"""
+    urls = []
+    escaped_url = False
+    i = 0
+    while i < len(content):
+        if content[i] == '<':
+            escaped_url = True
+            i += 1
+            continue
+
+        url_match = URL_PATTERN.match(content, i)
+        if url_match:
+            if not escaped_url or url_match.end() >= len(content) or url_match.end() < len(content) and content[url_match.end()] != '>':
+                urls.append(url_match.group())
+
+            i = url_match.end()
+            continue
+
+        escaped_url = False
+        i += 1
+
+    return urls
+
+
+def main():
+    corpus = make_corpus(200)
+
+    for content in corpus:
+        assert extract_with_scan(content) == extract_urls(content), content
+
+    total_chars = sum(len(content) for content in corpus)
+    total_urls = sum(len(extract_urls(content)) for content in corpus)
+
+    scan_time = min(timeit.repeat(lambda: [extract_with_scan(content) for content in corpus], number=5, repeat=3))
+    finditer_time = min(timeit.repeat(lambda: [extract_urls(content) for content in corpus], number=5, repeat=3))
+
+    print(f'{len(corpus)} messages, {total_chars} characters, {total_urls} urls')
+    print(f'scan:     {scan_time / 5 / len(corpus) * 1e6:9.1f}us per message')
+    print(f'finditer: {finditer_time / 5 / len(corpus) * 1e6:9.1f}us per message ({scan_time / finditer_time:0.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
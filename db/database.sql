@@ -73,3 +73,48 @@ CREATE TABLE IF NOT EXISTS artistTwitter (
 --     CONSTRAINT pk_avatarid PRIMARY KEY (avatarId),
 --     CONSTRAINT fk_userUserAvat FOREIGN KEY (userId) REFERENCES discordUser(userId)
 -- );
+
+CREATE TABLE IF NOT EXISTS reactionRoleBinding (
+    messageDId INTEGER NOT NULL,
+    channelDId INTEGER NOT NULL,
+    CONSTRAINT pk_rrBinding PRIMARY KEY (messageDId)
+);
+
+CREATE TABLE IF NOT EXISTS reactionRoleLink (
+    linkId INTEGER NOT NULL,
+    messageDId INTEGER NOT NULL,
+    CONSTRAINT pk_rrLink PRIMARY KEY (linkId),
+    CONSTRAINT fk_rrBinding_rrLink FOREIGN KEY (messageDId) REFERENCES reactionRoleBinding(messageDId)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rrLink_message ON reactionRoleLink (messageDId);
+
+CREATE TABLE IF NOT EXISTS reactionRoleReaction (
+    linkId INTEGER NOT NULL,
+    emoji TEXT NOT NULL, -- unicode emoji, or <:name:id> for custom ones
+    CONSTRAINT pk_rrReaction PRIMARY KEY (linkId, emoji),
+    CONSTRAINT fk_rrLink_rrReaction FOREIGN KEY (linkId) REFERENCES reactionRoleLink(linkId)
+);
+
+CREATE TABLE IF NOT EXISTS reactionRoleRole (
+    linkId INTEGER NOT NULL,
+    roleDId INTEGER NOT NULL,
+    CONSTRAINT pk_rrRole PRIMARY KEY (linkId, roleDId),
+    CONSTRAINT fk_rrLink_rrRole FOREIGN KEY (linkId) REFERENCES reactionRoleLink(linkId)
+);
+
+-- the reactions last seen on each bound message, to tell what changed while the bot was offline
+CREATE TABLE IF NOT EXISTS reactionRoleSnapshot (
+    messageDId INTEGER NOT NULL,
+    takenAt REAL NOT NULL,
+    CONSTRAINT pk_rrSnapshot PRIMARY KEY (messageDId),
+    CONSTRAINT fk_rrBinding_rrSnapshot FOREIGN KEY (messageDId) REFERENCES reactionRoleBinding(messageDId)
+);
+
+CREATE TABLE IF NOT EXISTS reactionRoleSeen (
+    messageDId INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    userDId INTEGER NOT NULL,
+    CONSTRAINT pk_rrSeen PRIMARY KEY (messageDId, emoji, userDId),
+    CONSTRAINT fk_rrBinding_rrSeen FOREIGN KEY (messageDId) REFERENCES reactionRoleBinding(messageDId)
+);
@@ -1,13 +1,10 @@
 """Get user information"""
-import json
-import os
 import re
 
 import discord
 import emoji
 from discord.ext import commands
 
-from koabot.koakuma import DATA_DIR
 from koabot.patterns import CHANNEL_URL_PATTERN, DISCORD_EMOJI_PATTERN
 
 
@@ -203,9 +200,6 @@ class UserActions(commands.Cog):
             return
 
         print('Saving bind...')
-        file_name = 'binds.json'
-        file_path = os.path.join(DATA_DIR, file_name)
-
         events_cog = self.bot.get_cog('BotEvents')
         events_cog.add_rr_watch(tmp_root['bind_message'], tmp_root['bind_channel'], tmp_root['links'])
 
@@ -218,31 +212,19 @@ class UserActions(commands.Cog):
             for reaction in link['reactions']:
                 await target_message.add_reaction(reaction)
 
-        # create file if it doesn't exist
-        if not os.path.isfile(file_path):
-            with open(file_path, 'w') as json_file:
-                json_file.write('{}')
-
-        with open(file_path, 'r+') as json_file:
-            tmp_obj = {}
-            tmp_obj['channel_id'] = tmp_root['bind_channel']
-            tmp_obj['links'] = tmp_root['links']
-
-            j_data = json.load(json_file)
-            j_data[tmp_root['bind_message']] = tmp_obj
-
-            for link in j_data[tmp_root['bind_message']]['links']:
-                link['reactions'] = list(link['reactions'])
-                link['roles'] = [r.id for r in link['roles']]
-
-            json_file.seek(0)
-            json_file.write(json.dumps(j_data))
-            json_file.truncate()
-
         self.rr_temporary_list.pop(bind_tag)
 
         await ctx.send('Registration complete!')
 
+    @reaction_roles.command()
+    @commands.is_owner()
+    async def export(self, ctx):
+        """Write every binding to binds.json, which is read back if the database is lost"""
+        events_cog = self.bot.get_cog('BotEvents')
+        bind_count = events_cog.rr_assignments.export_json(events_cog.rr_binds_path)
+
+        await ctx.send(f'Exported {bind_count} bindings.')
+
     @reaction_roles.command(aliases=['quit', 'exit', 'stop'])
     async def cancel(self, ctx):
         """Quit the reaction roles binding process"""
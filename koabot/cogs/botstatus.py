@@ -5,8 +5,11 @@ import re
 import subprocess
 from datetime import datetime
 
+import discord
 from discord.ext import commands
 
+import koabot.utils as utils
+
 
 class BotStatus(commands.Cog):
     """BotStatus class"""
@@ -65,9 +68,48 @@ class BotStatus(commands.Cog):
             await ctx.send("I can't get the temperature...")
 
     @commands.command(name='last')
-    async def talk_status(self, ctx):
-        """Mention a brief summary of the last used channel"""
-        await ctx.send(f'Last channel: {self.bot.last_channel}\nCurrent count there: {self.bot.last_channel_message_count}')
+    async def talk_status(self, ctx, channel: discord.TextChannel = None):
+        """Mention how many messages without embeds were sent lately in a channel, this one by default"""
+        channel = channel or ctx.channel
+        channel_activity = self.bot.get_cog('BotEvents').channel_activity
+        message_count = channel_activity.count(channel.id)
+
+        status = f'Messages without embeds in {channel.mention} over the last {channel_activity.window / 60:0.0f} minutes: {message_count}'
+
+        if str(channel.id) in self.bot.rules['quiet_channels']:
+            status += f"\nLimit there: {self.bot.rules['quiet_channels'][str(channel.id)]['max_messages_without_embeds']}"
+
+        await ctx.send(status)
+
+    @commands.command(name='netstats')
+    @commands.is_owner()
+    async def network_stats(self, ctx):
+        """Show how the requests made to every host are doing"""
+        summary = utils.net.get_session_manager().stats.summary().splitlines()
+
+        # keep every message under discord's character limit
+        chunk = []
+        for line in summary:
+            if sum(len(l) + 1 for l in chunk) + len(line) > 1900:
+                await ctx.send('```\n{}\n```'.format('\n'.join(chunk)))
+                chunk = []
+
+            chunk.append(line)
+
+        await ctx.send('```\n{}\n```'.format('\n'.join(chunk)))
+
+    @commands.command(name='msgstats')
+    @commands.is_owner()
+    async def message_stats(self, ctx):
+        """Show how many messages went through each stage of message handling, and how the preview queue is doing"""
+        events_cog = self.bot.get_cog('BotEvents')
+        stage_counts = events_cog.stage_counts
+        received = stage_counts['received'] or 1
+
+        lines = [f'{stage:<18}{count:>10}{count / received:>8.1%}' for stage, count in stage_counts.most_common()]
+        lines.append(f'\nPreview queue: {events_cog.link_jobs.summary()}')
+        lines.append(f'Role cooldowns: {events_cog.rr_cooldown.summary()}')
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
 
     @commands.command()
     async def uptime(self, ctx):
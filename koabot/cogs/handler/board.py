@@ -120,10 +120,10 @@ class Board(commands.Cog):
                 else:
                     url = 'https://safebooru.donmai.us'
 
-                return await utils.net.http_request(f'{url}/posts.json', auth=self.danbooru_auth, data=commentjson.dumps(data_arg), headers={'Content-Type': 'application/json'}, json=True, err_msg=f'error fetching search: {tags}')
+                return await utils.net.http_request(f'{url}/posts.json', auth=self.danbooru_auth, data=commentjson.dumps(data_arg), headers={'Content-Type': 'application/json'}, json=True, cache=not random, coalesce=not random, err_msg=f'error fetching search: {tags}')
         elif board == 'e621':
             # e621 requires to know the User-Agent
-            headers = guide['api']['headers']
+            headers = dict(guide['api']['headers'])
 
             if post_id:
                 url = guide['api']['id_search_url'].format(post_id)
@@ -135,7 +135,7 @@ class Board(commands.Cog):
                     url = 'https://e926.net'
 
                 headers['Content-Type'] = 'application/json'
-                return await utils.net.http_request(f'{url}/posts.json', auth=self.e621_auth, data=commentjson.dumps(data_arg), headers=headers, json=True, err_msg=f'error fetching search: {tags}')
+                return await utils.net.http_request(f'{url}/posts.json', auth=self.e621_auth, data=commentjson.dumps(data_arg), headers=headers, json=True, cache=not random, coalesce=not random, err_msg=f'error fetching search: {tags}')
         elif board == 'sankaku':
             if post_id:
                 url = guide['api']['id_search_url'].format(post_id)
@@ -143,7 +143,7 @@ class Board(commands.Cog):
             elif tags:
                 search_query = '+'.join(tags.split(' '))
                 url = guide['api']['tag_search_url'].format(search_query)
-                return await utils.net.http_request(url, json=True, err_msg=f'error fetching search: {tags}')
+                return await utils.net.http_request(url, json=True, cache=not random, coalesce=not random, err_msg=f'error fetching search: {tags}')
         else:
             raise ValueError(f'Board "{board}" can\'t be handled by the post searcher.')
 
@@ -167,6 +167,10 @@ class Board(commands.Cog):
                 If max_posts is set to 0 then no footer will be shown and no posts will be omitted.
             hide_posts_remaining::bool
                 Omit the final remaining count on the final post. False by default.
+
+        Returns:
+            discord.Message
+                The first message sent, or None if nothing was sent
         """
 
         board = kwargs.get('board', 'danbooru')
@@ -181,6 +185,7 @@ class Board(commands.Cog):
         total_posts = len(posts)
         posts_processed = 0
         last_post = False
+        sent_messages = []
 
         if max_posts != 0:
             posts = posts[:max_posts]
@@ -196,7 +201,7 @@ class Board(commands.Cog):
 
             # if there's no image file or image url, send a link
             if not embed.image.url:
-                await ctx.send(embed.url)
+                sent_messages.append(await ctx.send(embed.url))
                 continue
 
             if max_posts != 0:
@@ -218,20 +223,22 @@ class Board(commands.Cog):
                 else:
                     embed.set_image(url=self.bot.assets['default']['nsfw_placeholder'])
 
-                await ctx.send(f'<{embed.url}>', embed=embed)
+                sent_messages.append(await ctx.send(f'<{embed.url}>', embed=embed))
             else:
                 if board == 'danbooru':
                     if utils.posts.post_is_missing_preview(post, board=board) or last_post:
-                        await ctx.send(f'<{embed.url}>', embed=embed)
+                        sent_messages.append(await ctx.send(f'<{embed.url}>', embed=embed))
                     else:
-                        await ctx.send(embed.url)
+                        sent_messages.append(await ctx.send(embed.url))
                 elif board == 'e621' or board == 'sankaku':
-                    await ctx.send(f'<{embed.url}>', embed=embed)
+                    sent_messages.append(await ctx.send(f'<{embed.url}>', embed=embed))
                 else:
                     raise ValueError('Board embed send not configured.')
 
             print(f'Post #{post_id} complete')
 
+        return sent_messages[0] if sent_messages else None
+
     def generate_embed(self, post, **kwargs):
         """Generate embeds for image board post urls
         Arguments:
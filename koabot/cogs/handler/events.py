@@ -1,19 +1,28 @@
 """Bot events"""
-import json
+import asyncio
+import collections
 import os
 import random
 import re
-import timeit
+import sqlite3
+import time
+import weakref
 from datetime import datetime
 
 import discord
 import emoji
-import tldextract
 from discord.ext import commands
-from mergedeep import merge
 
+import koabot.utils.net
 from koabot.koakuma import DATA_DIR
-from koabot.patterns import URL_PATTERN
+from koabot.utils.activity import ActivityCounters
+from koabot.utils.jobs import JobQueue
+from koabot.utils.messages import MessageFeatures
+from koabot.utils.ordering import OrderedSends
+from koabot.utils.ratelimit import RateLimitStore, TokenBucket
+from koabot.utils.reactionroles import ReactionRoleBinds
+from koabot.utils.reactions import ReactionIndex
+from koabot.utils.urls import DomainDispatcher, extract_urls
 
 
 class BotEvents(commands.Cog):
@@ -23,88 +32,52 @@ class BotEvents(commands.Cog):
         self.bot = bot
         self.bot.connect_time = None
         self.bot.isconnected = False
-        self.bot.last_channel = 0
-        self.bot.last_channel_message_count = 0
-        self.bot.last_channel_warned = False
+        self.channel_activity = ActivityCounters(**self.bot.koa.get('channel_activity', {}))
         self.rr_confirmations = {}
-        self.rr_assignments = {}
-        self.rr_cooldown = {}
+        # role changes each user can make in a row, and how fast they're earned back
+        cooldown_settings = dict(self.bot.koa.get('reaction_roles', {}).get('cooldown', {}))
+        cooldown_rate = cooldown_settings.pop('rate', 0.1)
+        cooldown_burst = cooldown_settings.pop('burst', 6)
+        self.rr_cooldown = RateLimitStore(cooldown_rate, cooldown_burst, **cooldown_settings)
+        self.rr_cooldown_warnings = RateLimitStore(1 / 60, 1, max_entries=self.rr_cooldown.max_entries)
+        self.rr_reactions = ReactionIndex()
+        # (guild id, user id) -> reaction changes waiting to be turned into role changes
+        self.rr_pending = {}
+        self.rr_reconciling = False
+        # messages without a snapshot that were already reconciled against the roles members have
+        self.rr_first_reconciled = set()
+        # only guilds with galleries loading keep theirs, a new one is made once nothing holds it
+        self.guild_gallery_semaphores = weakref.WeakValueDictionary()
+        # how many messages went through each stage of on_message
+        self.stage_counts = collections.Counter()
+        self.link_jobs = JobQueue(**self.bot.koa.get('jobs', {}))
 
         # guides stuff
-        self.valid_urls = []
-        for group, contents in self.bot.match_groups.items():
-            for match in contents:
-                url_pattern = match['url']
-                url_pattern = url_pattern.replace('.', '\.')
-                url_pattern = url_pattern.replace('*', '(.*?)')
-                self.valid_urls.append({'group': group, 'url': url_pattern, 'guide': match['guide']})
-
-        for guide_type, v in self.bot.guides.items():
-            for guide_name, guide_content in v.items():
-                if 'inherits' not in guide_content:
-                    continue
-
-                guide_to_inherit = guide_content['inherits'].split('/')
-                source_guide = self.bot.guides[guide_type][guide_name]
-
-                if len(guide_to_inherit) > 1:
-                    target_guide = self.bot.guides[guide_to_inherit[0]][guide_to_inherit[1]]
-                else:
-                    target_guide = self.bot.guides[guide_type][guide_to_inherit[0]]
-
-                combined_guide = merge({}, target_guide, source_guide)
-                self.bot.guides[guide_type][guide_name] = combined_guide
+        self.domain_dispatcher = DomainDispatcher(self.bot.match_groups)
 
-        # load reaction role binds
-        file_path = os.path.join(DATA_DIR, 'binds.json')
-        if os.path.isfile(file_path):
-            with open(file_path, 'r') as json_file:
-                j_data = json.load(json_file)
+        # reaction role binds are read from the database as they're needed
+        sqlite_conn = getattr(self.bot, 'sqlite_conn', None)
+        if sqlite_conn is None:
+            print('Reaction role bindings will not be kept without a database.')
+            sqlite_conn = sqlite3.connect(':memory:')
+            with open('db/database.sql') as f:
+                sqlite_conn.executescript(f.read())
 
-                for message_id, v in j_data.items():
-                    self.add_rr_watch(message_id, v['channel_id'], v['links'])
+        # the old binds.json, or one written by !rr export, fills the database if it's empty
+        self.rr_binds_path = os.path.join(DATA_DIR, 'binds.json')
+        self.rr_assignments = ReactionRoleBinds(sqlite_conn)
+        self.rr_assignments.import_json(self.rr_binds_path)
 
     async def manage_rr_cooldown(self, user: discord.User):
         """Prevents users from overloading role requests"""
-        SPAM_LIMIT = 12
-        current_time = timeit.default_timer()
-        user_id = str(user.id)
-
-        if user_id not in self.rr_cooldown:
-            tmp_obj = {}
-            tmp_obj['cooldown_start'] = current_time
-            tmp_obj['change_count'] = 0
-            self.rr_cooldown[user_id] = tmp_obj
-
-        tmp_root = self.rr_cooldown[user_id]
-        time_diff = current_time - tmp_root['cooldown_start']
-
-        # if too many reactions were sent
-        if tmp_root['change_count'] > SPAM_LIMIT:
-            if time_diff < 60:
-                return True
-
-            tmp_root['cooldown_start'] = current_time
-            tmp_root['change_count'] = 0
-
-        # refresh cooldown if two minutes have passed
-        if time_diff > 120:
-            tmp_root['cooldown_start'] = current_time
-            tmp_root['change_count'] = 0
-        elif time_diff < 1:
-            tmp_root['change_count'] += 3
-        elif time_diff < 5:
-            tmp_root['change_count'] += 2
-        else:
-            tmp_root['change_count'] += 1
+        if self.rr_cooldown.acquire(user.id):
+            return False
 
-        # send a warning and freeze
-        if tmp_root['change_count'] > SPAM_LIMIT:
-            tmp_root['cooldown_start'] = current_time
+        # send a warning and freeze, but don't warn again until the cooldown wears off
+        if self.rr_cooldown_warnings.acquire(user.id):
             await user.send('Please wait a few moments and try again')
-            return True
 
-        return False
+        return True
 
     def add_rr_confirmation(self, message_id: str, bind_tag: str, single_link: list, emoji_list: list):
         """Creates an entry pending to be handled for reaction roles overwrite request"""
@@ -114,99 +87,320 @@ class BotEvents(commands.Cog):
         self.rr_confirmations[message_id]['link'] = single_link
 
     def add_rr_watch(self, message_id: str, channel_id: str, links: list):
-        """Starts keeping track of what messages have bound actions"""
-        tmp_obj = {}
-        tmp_obj['channel_id'] = channel_id
-        tmp_obj['links'] = links
+        """Starts keeping track of what messages have bound actions, saving them"""
+        self.rr_assignments.save(message_id, channel_id, links)
+        # the bound emojis may have changed
+        self.rr_reactions.forget(int(message_id))
 
-        self.rr_assignments[message_id] = tmp_obj
+    def get_bound_reactions(self, message_id: int):
+        """Get every emoji bound to a role on a message"""
+        bound_reactions = set()
+        for link in self.rr_assignments[str(message_id)]['links']:
+            bound_reactions.update(link['reactions'])
 
-    async def assign_roles(self, emoji_sent: str, user: discord.Member, message_id: int, channel_id: int):
-        """Updates the roles of the given user
-        Parameters:
-            user::discord.Member
-            message_id::int
-            channel_id::int
+        return bound_reactions
+
+    def get_link_roles(self, guild: discord.Guild, link: dict):
+        """Get the roles a link gives that still exist in the guild"""
+        return [r for r in map(guild.get_role, (getattr(r, 'id', r) for r in link['roles'])) if r]
+
+    async def seed_reaction_index(self):
+        """Read the reactions of every message bound to roles, so that reaction events need no requests"""
+        for message_id, rr_watch in list(self.rr_assignments.items()):
+            channel = self.bot.get_channel(int(rr_watch['channel_id']))
+
+            if channel is None:
+                continue
+
+            try:
+                await self.rr_reactions.refresh(channel, int(message_id), self.get_bound_reactions(message_id))
+            except discord.HTTPException as e:
+                print(f'Could not read the reactions of message #{message_id}: {e}')
+
+    async def reconcile_reaction_roles(self):
+        """Give and take the roles of the reactions that changed while the bot was offline
+
+        The reactions read by seed_reaction_index are compared against the
+        last ones whose roles were handled, so it has to run first. Only the
+        members whose reactions differ have their roles changed, which leaves
+        roles given by hand alone.
+
+        Messages without a snapshot yet, like those bound before snapshots
+        were kept, have nothing to compare against. Members reacting to them
+        get the roles of the links they match now, but no role is taken away.
+        This is done once per message and process, so that a dry run doesn't
+        repeat it on every reconnect.
         """
-        channel = self.bot.get_channel(channel_id)
-        message = await channel.fetch_message(message_id)
-        user_id = user.id
+        settings = self.bot.koa.get('reaction_roles', {}).get('reconcile', {})
 
-        message_reactions = set()
-        for em in message.reactions:
-            if not isinstance(em, str):
-                em = str(em)
+        if not settings.get('enabled', True) or self.rr_reconciling:
+            return
 
-            message_reactions.add(em)
+        self.rr_assignments.flush_snapshot()
 
-        bound_reactions = set()
-        for link in self.rr_assignments[str(message_id)]['links']:
-            bound_reactions.update(link['reactions'])
+        # member -> (roles to add, roles to remove)
+        changes = {}
+        # messages that were read, whose snapshot is taken again once done
+        read_messages = []
 
-        reactions_in_use = bound_reactions.intersection(message_reactions)
-        reactions_by_currentuser = []
+        for message_id, rr_watch in list(self.rr_assignments.items()):
+            channel = self.bot.get_channel(int(rr_watch['channel_id']))
+            reactions_now = self.rr_reactions.messages.get(int(message_id))
 
-        for reaction in message.reactions:
-            if not isinstance(reaction.emoji, str):
-                em = str(reaction.emoji)
-            else:
-                em = reaction.emoji
+            # messages that couldn't be read keep their old snapshot until they can be compared
+            if channel is None or reactions_now is None:
+                continue
+
+            read_messages.append(message_id)
+            reactions_before = self.rr_assignments.get_snapshot(message_id)
+
+            if reactions_before is None:
+                if message_id in self.rr_first_reconciled:
+                    continue
+
+                self.rr_first_reconciled.add(message_id)
+
+                for user_id in set().union(*reactions_now.values()):
+                    member = channel.guild.get_member(user_id)
+
+                    if member is None:
+                        continue
+
+                    for link in rr_watch['links']:
+                        if all(user_id in reactions_now.get(em, ()) for em in link['reactions']):
+                            changes.setdefault(member, ([], []))[0].extend(self.get_link_roles(channel.guild, link))
 
-            if em not in reactions_in_use:
                 continue
 
-            for u in await reaction.users().flatten():
-                if u.id != user_id:
+            changed_user_ids = set()
+            for em in set(reactions_now) | set(reactions_before):
+                changed_user_ids.update(reactions_now.get(em, set()) ^ reactions_before.get(em, set()))
+
+            for user_id in changed_user_ids:
+                member = channel.guild.get_member(user_id)
+
+                if member is None:
                     continue
 
-                reactions_by_currentuser.append(em)
+                for link in rr_watch['links']:
+                    matched_before = all(user_id in reactions_before.get(em, ()) for em in link['reactions'])
+                    matches_now = all(user_id in reactions_now.get(em, ()) for em in link['reactions'])
 
-        # match with links
-        for link in self.rr_assignments[str(message_id)]['links']:
-            if not isinstance(link['reactions'], set):
-                link['reactions'] = set(link['reactions'])
+                    if matched_before == matches_now:
+                        continue
+
+                    changes.setdefault(member, ([], []))[0 if matches_now else 1].extend(self.get_link_roles(channel.guild, link))
+
+        for member, (roles_to_add, roles_to_remove) in changes.items():
+            roles_to_add[:] = [r for r in dict.fromkeys(roles_to_add) if r not in member.roles]
+            roles_to_remove[:] = [r for r in dict.fromkeys(roles_to_remove) if r in member.roles and r not in roles_to_add]
+
+        changes = {m: c for m, c in changes.items() if not m.bot and (c[0] or c[1])}
+
+        if changes:
+            await self.apply_reconciled_roles(changes, settings)
 
-            link_fully_matches = link['reactions'].issubset(reactions_by_currentuser)
+        # a dry run leaves the differences in place for the next startup
+        if not settings.get('dry_run', False):
+            for message_id in read_messages:
+                self.rr_assignments.save_snapshot(message_id, self.rr_reactions.messages.get(int(message_id), {}))
 
-            if emoji_sent not in link['reactions']:
+    async def apply_reconciled_roles(self, changes: dict, settings: dict):
+        """Edit the roles of every member found by reconcile_reaction_roles, a few at a time
+        Arguments:
+            changes::dict
+                discord.Member -> (roles to add, roles to remove)
+            settings::dict
+                The reaction_roles.reconcile settings
+        """
+        dry_run = settings.get('dry_run', False)
+        progress_every = settings.get('progress_every', 25)
+
+        self.rr_reconciling = True
+        print(f'{"Would update" if dry_run else "Updating"} the reaction roles of {len(changes)} members')
+
+        # discord.py waits out rate limits on its own, this keeps the edits from piling up in the first place
+        bucket = TokenBucket(settings.get('rate', 1), settings.get('burst', 5))
+
+        try:
+            for i, (member, (roles_to_add, roles_to_remove)) in enumerate(changes.items(), 1):
+                if dry_run:
+                    print(f'{member}: +{[r.name for r in roles_to_add]} -{[r.name for r in roles_to_remove]}')
+                else:
+                    await bucket.acquire()
+                    member = member.guild.get_member(member.id)
+
+                    # members still reacting are left to assign_roles
+                    if member and (member.guild.id, member.id) not in self.rr_pending:
+                        new_roles = [r for r in member.roles[1:] if r not in roles_to_remove] + [r for r in roles_to_add if r not in member.roles]
+
+                        try:
+                            await member.edit(roles=new_roles, reason='Reactions changed while offline')
+                        except discord.HTTPException as e:
+                            print(f'Could not update the roles of {member}: {e}')
+
+                if i % progress_every == 0 or i == len(changes):
+                    print(f'Reaction roles: {i}/{len(changes)} members {"checked" if dry_run else "updated"}')
+        finally:
+            self.rr_reconciling = False
+
+    async def update_reaction_index(self, payload: discord.RawReactionActionEvent, added: bool):
+        """Apply a reaction event to the index of a message bound to roles"""
+        channel = self.bot.get_channel(payload.channel_id)
+        await self.rr_reactions.ensure(channel, payload.message_id, self.get_bound_reactions(payload.message_id))
+
+        if added:
+            self.rr_reactions.add(payload.message_id, str(payload.emoji), payload.user_id)
+        else:
+            self.rr_reactions.remove(payload.message_id, str(payload.emoji), payload.user_id)
+
+    def snapshot_role_update(self, user: discord.Member, pending: dict):
+        """Take note of the reactions whose roles were just handled, for the next startup to compare against"""
+        for message_id, em in pending['initial']:
+            if str(message_id) not in self.rr_assignments:
                 continue
 
-            role_removal = False
-            if not link_fully_matches:
-                reactions_by_currentuser.append(emoji_sent)
-                role_removal = link['reactions'].issubset(reactions_by_currentuser)
+            reacted = bool(self.rr_reactions.get_user_reactions(message_id, user.id, [em]))
+            self.rr_assignments.snapshot_reaction(message_id, em, user.id, reacted)
+
+        self.rr_assignments.flush_snapshot()
+
+    def queue_role_update(self, user: discord.Member, message_id: int, emoji_sent: str, added: bool):
+        """Take note of a reaction change, to be turned into role changes once the user stops reacting for a moment"""
+        key = (user.guild.id, user.id)
+        now = time.monotonic()
+
+        if key not in self.rr_pending:
+            self.rr_pending[key] = {'first_at': now, 'last_at': now, 'initial': {}}
+            self.bot.loop.create_task(self.assign_roles(user, key))
+
+        pending = self.rr_pending[key]
+        pending['last_at'] = now
+        # what matters is how the reactions were before the first change
+        pending['initial'].setdefault((message_id, emoji_sent), not added)
+
+    async def assign_roles(self, user: discord.Member, key: tuple):
+        """Updates the roles of the given user with everything they reacted with lately, in a single request
+        Parameters:
+            user::discord.Member
+            key::tuple
+                The guild and user ids the pending changes are under
+        """
+        rr_settings = self.bot.koa.get('reaction_roles', {})
+        debounce = rr_settings.get('debounce', 2)
+        max_debounce = rr_settings.get('max_debounce', 10)
+        pending = self.rr_pending[key]
+
+        # wait until there's a pause in the reactions, but not forever
+        while True:
+            delay = min(pending['last_at'] + debounce, pending['first_at'] + max_debounce) - time.monotonic()
+
+            if delay <= 0:
+                break
+
+            await asyncio.sleep(delay)
+
+        self.rr_pending.pop(key)
 
-                if not role_removal:
+        user = user.guild.get_member(user.id)
+        if user is None or await self.manage_rr_cooldown(user):
+            return
+
+        roles_to_add = []
+        roles_to_remove = []
+
+        for message_id in {message_id for (message_id, _) in pending['initial']}:
+            if str(message_id) not in self.rr_assignments:
+                continue
+
+            reactions_now = set(self.rr_reactions.get_user_reactions(message_id, user.id, self.get_bound_reactions(message_id)))
+            reactions_before = set(reactions_now)
+            changed_reactions = set()
+
+            for (initial_message_id, em), had_reaction in pending['initial'].items():
+                if initial_message_id != message_id:
                     continue
 
-            if not isinstance(link['roles'][0], discord.Role):
-                link['roles'] = list(map(channel.guild.get_role, link['roles']))
+                changed_reactions.add(em)
+                if had_reaction:
+                    reactions_before.add(em)
+                else:
+                    reactions_before.discard(em)
 
-            if role_removal:
-                await user.remove_roles(*link['roles'], reason='Requested by the own user by reacting')
-                quote = f'{user.mention}, say goodbye to XX...'
-            else:
-                await user.add_roles(*link['roles'], reason='Requested by the own user by reacting')
-                quote = f'Congrats, {user.mention}. You get the XX YY!'
+            # match with links
+            for link in self.rr_assignments[str(message_id)]['links']:
+                if not isinstance(link['reactions'], set):
+                    link['reactions'] = set(link['reactions'])
 
-            if len(link['roles']) > 1:
-                roles = ', '.join(f"**@{r.name}**" for r in link['roles'])
-            else:
-                roles = link['roles'][0].name
-                roles = f"**@{roles}**"
+                if not link['reactions'].intersection(changed_reactions):
+                    continue
+
+                matched_before = link['reactions'].issubset(reactions_before)
+                matches_now = link['reactions'].issubset(reactions_now)
+
+                # toggled back and forth, nothing to do
+                if matched_before == matches_now:
+                    continue
+
+                if not isinstance(link['roles'][0], discord.Role):
+                    link['roles'] = list(map(user.guild.get_role, link['roles']))
+
+                if matches_now:
+                    roles_to_add.extend(link['roles'])
+                else:
+                    roles_to_remove.extend(link['roles'])
+
+        roles_to_add = [r for r in dict.fromkeys(roles_to_add) if r and r not in user.roles]
+        roles_to_remove = [r for r in dict.fromkeys(roles_to_remove) if r and r in user.roles and r not in roles_to_add]
+
+        if not roles_to_add and not roles_to_remove:
+            self.snapshot_role_update(user, pending)
+            return
 
-            quote = quote.replace('XX', roles)
-            quote = quote.replace('YY', 'roles' if len(link['roles']) > 1 else 'role')
+        # everyone has the default role, it's not sent along
+        new_roles = [r for r in user.roles[1:] if r not in roles_to_remove] + roles_to_add
+        try:
+            await user.edit(roles=new_roles, reason='Requested by the own user by reacting')
+        except discord.HTTPException as e:
+            print(f'Could not update the roles of {user}: {e}')
 
             try:
-                print(quote)
-                await user.send(quote)
+                await user.send(f"Sorry, {user.mention}. I couldn't update your roles, please try again later.")
             except discord.Forbidden:
-                print(f"I couldn't notify {user.name} about {roles}...")
+                print(f"I couldn't notify {user.name} about their roles...")
+
+            return
+
+        # changes dropped by the cooldown or a failed edit stay out, so the next startup makes up for them
+        self.snapshot_role_update(user, pending)
+
+        quotes = []
+        for roles, quote in [(roles_to_add, f'Congrats, {user.mention}. You get the XX YY!'), (roles_to_remove, f'{user.mention}, say goodbye to XX...')]:
+            if not roles:
+                continue
+
+            role_names = ', '.join(f"**@{r.name}**" for r in roles)
+            quote = quote.replace('XX', role_names)
+            quote = quote.replace('YY', 'roles' if len(roles) > 1 else 'role')
+            quotes.append(quote)
+
+        quote = '\n'.join(quotes)
+
+        try:
+            print(quote)
+            await user.send(quote)
+        except discord.Forbidden:
+            print(f"I couldn't notify {user.name} about their roles...")
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """When a user adds a reaction to a message"""
+        handle_reactionrole = str(payload.message_id) in self.rr_assignments
+
+        # the index follows every reaction, even from members that aren't cached
+        if handle_reactionrole:
+            await self.update_reaction_index(payload, added=True)
+
         if payload.user_id == self.bot.user.id:
             return
 
@@ -222,7 +416,6 @@ class BotEvents(commands.Cog):
             return
 
         handle_confirmation = str(payload.message_id) in self.rr_confirmations
-        handle_reactionrole = str(payload.message_id) in self.rr_assignments
 
         if handle_confirmation:
             tmp_root = self.rr_confirmations[payload.message_id]
@@ -255,14 +448,17 @@ class BotEvents(commands.Cog):
             else:
                 await message.add_reaction(emoji.emojize(':stop_sign:', use_aliases=True))
         elif handle_reactionrole:
-            if await self.manage_rr_cooldown(user):
-                return
-
-            await self.assign_roles(str(payload.emoji), user, payload.message_id, payload.channel_id)
+            self.queue_role_update(user, payload.message_id, str(payload.emoji), added=True)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
         """When a user removes a reaction from a message"""
+        handle_reactionrole = str(payload.message_id) in self.rr_assignments
+
+        # the index follows every reaction, even from members that aren't cached
+        if handle_reactionrole:
+            await self.update_reaction_index(payload, added=False)
+
         if payload.user_id == self.bot.user.id:
             return
 
@@ -273,13 +469,24 @@ class BotEvents(commands.Cog):
         if user is None or user.bot:
             return
 
-        handle_reactionrole = str(payload.message_id) in self.rr_assignments
-
         if handle_reactionrole:
-            if await self.manage_rr_cooldown(user):
-                return
+            self.queue_role_update(user, payload.message_id, str(payload.emoji), added=False)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        """When every reaction is removed from a message"""
+        self.rr_reactions.clear(payload.message_id)
+
+        if str(payload.message_id) in self.rr_assignments:
+            self.rr_assignments.clear_snapshot(payload.message_id)
 
-            await self.assign_roles(str(payload.emoji), user, payload.message_id, payload.channel_id)
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        """When every reaction of an emoji is removed from a message"""
+        self.rr_reactions.clear(payload.message_id, str(payload.emoji))
+
+        if str(payload.message_id) in self.rr_assignments:
+            self.rr_assignments.clear_snapshot(payload.message_id, str(payload.emoji))
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -293,15 +500,109 @@ class BotEvents(commands.Cog):
         if len(before.embeds) > 0 and len(after.embeds) == 0:
             await after.edit(suppress=False)
 
+    async def run_preview(self, coro, url: str):
+        """Give a link preview the time budget set in the config, abandoning it if it takes longer
+        Every request made while building the preview shares the budget.
+        """
+        preview_budget = self.bot.koa.get('network', {}).get('preview_budget', 30)
+
+        try:
+            return await koabot.utils.net.run_within_deadline(coro, preview_budget)
+        except asyncio.TimeoutError:
+            print(f'> {datetime.now()}\nGave up on the preview of {url} after {preview_budget}s')
+            return None
+
+    def cog_unload(self):
+        self.link_jobs.close()
+
+    def get_guild_gallery_semaphore(self, guild: discord.Guild):
+        """Get the semaphore that limits how many galleries a guild can have loading at once"""
+        semaphore = self.guild_gallery_semaphores.get(guild.id)
+
+        if semaphore is None:
+            concurrency = self.bot.koa.get('gallery', {}).get('guild_concurrency', 4)
+            semaphore = self.guild_gallery_semaphores[guild.id] = asyncio.Semaphore(concurrency)
+
+        return semaphore
+
+    async def show_galleries(self, msg: discord.Message, gallery: list):
+        """Load the galleries of every link in a message at once, posting them in the order the links were sent"""
+        imageboard_cog = self.bot.get_cog('ImageBoard')
+        message_semaphore = asyncio.Semaphore(self.bot.koa.get('gallery', {}).get('concurrency', 3))
+        guild_semaphore = self.get_guild_gallery_semaphore(msg.guild)
+        sends = OrderedSends(len(gallery))
+
+        async def show_gallery(slot: int, entry: dict):
+            try:
+                async with message_semaphore, guild_semaphore:
+                    await self.run_preview(imageboard_cog.show_gallery(sends.wrap(msg, slot), entry['url'], board=entry['board'], guide=entry['guide']), entry['url'])
+            finally:
+                sends.finish(slot)
+
+        results = await asyncio.gather(*[show_gallery(slot, entry) for slot, entry in enumerate(gallery)], return_exceptions=True)
+
+        # let every gallery finish before reporting the first one that failed
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def preview_links(self, msg: discord.Message, features: MessageFeatures, urls: list):
+        """Show the previews of the links in a message"""
+        url_matches_found = []
+        for full_url in urls:
+            url_matches_found.append({'full_url': full_url, 'fqdn': koabot.utils.net.get_domain(full_url)})
+
+        gallery = []
+        for url_match in url_matches_found:
+            match_group = self.domain_dispatcher.resolve(url_match['fqdn'])
+
+            if not match_group:
+                continue
+
+            group, guides = match_group
+
+            for guide in guides:
+                guide_type = guide['type']
+                guide_name = guide['name']
+
+                try:
+                    guide_content = self.bot.guides[guide_type][guide_name]
+                except KeyError as e:
+                    print(f'KeyError: "{e.args[0]}" is an undefined guide name or type .')
+                    continue
+
+                full_url = url_match['full_url']
+
+                if guide_type == 'gallery':
+                    gallery.append({'url': full_url, 'board': group, 'guide': guide_content})
+                elif guide_type == 'stream' and group == 'picarto':
+                    self.stage_counts['stream_previews'] += 1
+                    streams_cog = self.bot.get_cog('StreamService')
+                    picarto_preview_shown = await self.run_preview(streams_cog.get_picarto_stream_preview(msg, full_url), full_url)
+
+                    if picarto_preview_shown and features.has_prefix:
+                        await msg.delete()
+
+        # booru galleries are only posted if they were asked for by starting the message with '!'
+        if not features.has_prefix:
+            gallery = [entry for entry in gallery if entry['board'] not in ['danbooru', 'e621', 'sankaku']]
+
+        if gallery:
+            self.stage_counts['galleries'] += 1
+            await self.show_galleries(msg, gallery[:self.bot.koa.get('gallery', {}).get('max_links', 4)])
+
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
         """Searches messages for urls and certain keywords"""
+        self.stage_counts['received'] += 1
 
         # Prevent bot from spamming itself
         if msg.author.bot:
+            self.stage_counts['ignored'] += 1
             return
 
         if msg.guild is None:
+            self.stage_counts['ignored'] += 1
             print(f'{msg.author.name}#{msg.author.discriminator} ({msg.author.id}): {msg.content}')
             return
 
@@ -313,125 +614,81 @@ class BotEvents(commands.Cog):
             # ...and i'm the debug instance
             if msg.guild.me.id == beta_bot_id:
                 # do nothing
+                self.stage_counts['ignored'] += 1
                 return
         # if it's a debug user
         else:
             beta_bot = msg.guild.get_member(beta_bot_id)
 
-            # ...and the debug instance is online
-            if beta_bot and beta_bot.status == discord.Status.online:
+            # ...and the debug instance is running
+            if beta_bot and self.bot.instance_lease.beta_active:
                 # ...and i'm not the debug instance
                 if msg.guild.me.id != beta_bot_id:
                     # do nothing
+                    self.stage_counts['ignored'] += 1
                     return
 
         channel = msg.channel
+        features = MessageFeatures(msg, self.bot.command_prefix)
 
-        # Reference channels together
-        for mentioned_channel in msg.channel_mentions:
-            if mentioned_channel == channel:
-                continue
-
-            embed_template = discord.Embed()
-            embed_template.set_author(name=msg.author.display_name, icon_url=msg.author.avatar_url)
-            embed_template.set_footer(text=msg.guild.name, icon_url=msg.guild.icon_url)
-
-            target_embed = embed_template.copy()
-            target_embed.description = f'Mention by {msg.author.mention} from {channel.mention}\n\n[Click to go there]({msg.jump_url})'
-            target_channel_msg = await mentioned_channel.send(embed=target_embed)
+        if features.is_plain:
+            self.stage_counts['plain'] += 1
 
-            origin_embed = embed_template.copy()
-            origin_embed.description = f'Mention by {msg.author.mention} to {mentioned_channel.mention}\n\n[Click to go there]({target_channel_msg.jump_url})'
-            await channel.send(embed=origin_embed)
-
-        url_matches_found = []
-        escaped_url = False
-        i = 0
-        while i < len(msg.content):
-            # check for urls, ignoring those with escaped embeds
-            if msg.content[i] == '<':
-                escaped_url = True
-                i += 1
-                continue
-
-            url_match = URL_PATTERN.match(msg.content, i)
-            # TODO Soon... in Python 3.8
-            # if (url_match := URL_PATTERN.match(msg.content, i)):
-            if url_match:
-                if not escaped_url or url_match.end() >= len(msg.content) or url_match.end() < len(msg.content) and msg.content[url_match.end()] != '>':
-                    url_matches_found.append({'full_url': url_match.group(), 'fqdn': tldextract.extract(url_match.group()).fqdn})
-
-                i = url_match.end()
-                continue
-
-            escaped_url = False
-            i += 1
-
-        gallery = []
-        for url_match in url_matches_found:
-            for valid_url in self.valid_urls:
-                group = valid_url['group']
-                url_pattern = valid_url['url']
-                guides = valid_url['guide']
+        # Reference channels together
+        if features.has_channel_mentions:
+            self.stage_counts['channel_mentions'] += 1
 
-                # match() matches only from the start of the string
-                if not re.match(url_pattern, url_match['fqdn']):
+            for mentioned_channel in msg.channel_mentions:
+                if mentioned_channel == channel:
                     continue
 
-                for guide in guides:
-                    guide_type = guide['type']
-                    guide_name = guide['name']
+                embed_template = discord.Embed()
+                embed_template.set_author(name=msg.author.display_name, icon_url=msg.author.avatar_url)
+                embed_template.set_footer(text=msg.guild.name, icon_url=msg.guild.icon_url)
 
-                    try:
-                        guide_content = self.bot.guides[guide_type][guide_name]
-                    except KeyError as e:
-                        print(f'KeyError: "{e.args[0]}" is an undefined guide name or type .')
-                        continue
+                target_embed = embed_template.copy()
+                target_embed.description = f'Mention by {msg.author.mention} from {channel.mention}\n\n[Click to go there]({msg.jump_url})'
+                target_channel_msg = await mentioned_channel.send(embed=target_embed)
 
-                    full_url = url_match['full_url']
+                origin_embed = embed_template.copy()
+                origin_embed.description = f'Mention by {msg.author.mention} to {mentioned_channel.mention}\n\n[Click to go there]({target_channel_msg.jump_url})'
+                await channel.send(embed=origin_embed)
 
-                    if guide_type == 'gallery':
-                        gallery.append({'url': full_url, 'board': group, 'guide': guide_content})
-                    elif guide_type == 'stream' and group == 'picarto':
-                        streams_cog = self.bot.get_cog('StreamService')
-                        picarto_preview_shown = await streams_cog.get_picarto_stream_preview(msg, full_url)
+        urls = []
+        if features.has_urls:
+            self.stage_counts['url_scans'] += 1
+            urls = extract_urls(msg.content)
 
-                        if picarto_preview_shown and msg.content[0] == '!':
-                            await msg.delete()
+        # previews are slow, they're left to the workers so that the next messages don't wait on them
+        if urls:
+            self.stage_counts['urls_found'] += 1
 
-                # done with this url
-                break
-
-        # post gallery only if there's one to show...
-        if len(gallery) == 1:
-            gallery = gallery[0]
-            # ...only if it was asked for by starting their message with '!', for booru galleries
-            if gallery['board'] in ['danbooru', 'e621', 'sankaku']:
-                if msg.content[0] == '!':
-                    imageboard_cog = self.bot.get_cog('ImageBoard')
-                    await imageboard_cog.show_gallery(msg, gallery['url'], board=gallery['board'], guide=gallery['guide'])
-            # or if it's anything else
-            else:
-                imageboard_cog = self.bot.get_cog('ImageBoard')
-                await imageboard_cog.show_gallery(msg, gallery['url'], board=gallery['board'], guide=gallery['guide'])
+            if not self.link_jobs.submit(msg.guild.id, self.preview_links, msg, features, urls):
+                self.stage_counts['previews_dropped'] += 1
+                print(f'> {datetime.now()}\nToo many previews queued, skipped the links of {msg.jump_url}')
 
         # checking if a command has been issued
         command_issued = False
-        if msg.content[0] == '!':
+        if features.has_prefix:
+            self.stage_counts['command_checks'] += 1
             command_name_regex = re.search(r'^!([a-zA-Z0-9]+)', msg.content)
             if command_name_regex:
                 cmd = self.bot.get_command(command_name_regex.group(1))
                 command_issued = bool(cmd)
 
-        if self.bot.last_channel != channel.id or url_matches_found or msg.attachments or command_issued:
-            self.bot.last_channel = channel.id
-            self.bot.last_channel_message_count = 0
-        else:
-            self.bot.last_channel_message_count += 1
+        if features.has_attachments:
+            self.stage_counts['attachments'] += 1
+
+        activity = self.channel_activity.add(channel.id, has_embeds=bool(urls or features.has_attachments or command_issued))
 
         if str(channel.id) in self.bot.rules['quiet_channels']:
-            if not self.bot.last_channel_warned and self.bot.last_channel_message_count >= self.bot.rules['quiet_channels'][str(channel.id)]['max_messages_without_embeds']:
-                self.bot.last_channel_warned = True
+            max_messages = self.bot.rules['quiet_channels'][str(channel.id)]['max_messages_without_embeds']
+
+            # warn once each time the channel goes over the limit
+            if activity.total < max_messages:
+                activity.warned = False
+            elif not activity.warned:
+                activity.warned = True
                 bot_cog = self.bot.get_cog('BotStatus')
 
                 await bot_cog.typing_a_message(channel, content=random.choice(self.bot.quotes['quiet_channel_past_threshold']), rnd_duration=[1, 2])
@@ -444,6 +701,10 @@ class BotEvents(commands.Cog):
         # Change play status to something fitting
         await self.bot.change_presence(activity=discord.Game(name=random.choice(self.bot.quotes['playing_status'])))
 
+        # reactions may have changed while disconnected
+        await self.seed_reaction_index()
+        await self.reconcile_reaction_roles()
+
     @commands.Cog.listener()
     async def on_connect(self):
         """On connect"""
@@ -2,7 +2,6 @@
 import ast
 import os
 import random
-import shutil
 from pathlib import Path
 
 import discord
@@ -26,8 +25,28 @@ class Gallery(commands.Cog):
         twit_auth.set_access_token(bot.auth_keys['twitter']['token'], bot.auth_keys['twitter']['token_secret'])
         self.twitter_api = tweepy.API(twit_auth, wait_on_rate_limit=True)
         self.pixiv_aapi = pixivpy_async.AppPixivAPI()
+        self.recent_posts = utils.posts.RecentPosts(**bot.koa.get('gallery', {}).get('reposts', {}))
         self.pixiv_refresh_token = None
 
+    async def is_repost(self, msg, board: str, post_id):
+        """Check whether a post was already previewed in the channel a short while ago, pointing to it if it was"""
+        earlier_jump_url = self.recent_posts.find(msg.channel.id, board, post_id)
+
+        if not earlier_jump_url:
+            return False
+
+        print(f'Skipping {board} post #{post_id}, it was just previewed in this channel')
+
+        if self.bot.koa.get('gallery', {}).get('reposts', {}).get('link_back', True):
+            await msg.channel.send(f'Already shown here: <{earlier_jump_url}>')
+
+        return True
+
+    def remember_preview(self, msg, board: str, post_id, preview: discord.Message):
+        """Take note of the first message of a preview, so that reposts can link back to it"""
+        if preview:
+            self.recent_posts.remember(msg.channel.id, board, post_id, preview.jump_url)
+
     async def display_static(self, channel, msg, url, **kwargs):
         """Display posts from a gallery in separate unmodifiable embeds
         Arguments:
@@ -58,15 +77,19 @@ class Gallery(commands.Cog):
         if not guide:
             raise ValueError("The 'guide' keyword argument is not defined.")
 
-        id_start = guide['post']['id_start']
-        id_end = guide['post']['id_end']
+        # don't bother if the board has been failing to answer
+        if not utils.net.is_available(guide['api']['id_search_url']):
+            print(f'Skipping {board} gallery, the board is down.')
+            return
 
         on_nsfw_channel = channel.is_nsfw()
-        post_id = utils.posts.get_post_id(url, id_start, id_end, has_regex=end_regex)
+        post_id = guide.get_post_id(url, has_regex=end_regex)
 
-        if not post_id:
+        if not post_id or await self.is_repost(msg, board, post_id):
             return
 
+        # the id in the url, which is what reposts are looked up by
+        url_post_id = post_id
         board_cog = self.bot.get_cog('Board')
 
         post = (await board_cog.search_query(board=board, guide=guide, post_id=post_id)).json
@@ -118,7 +141,8 @@ class Gallery(commands.Cog):
         else:
             if first_post_missing_preview:
                 if post['rating'] == 's' or on_nsfw_channel:
-                    await board_cog.send_posts(channel, post, board=board, guide=guide)
+                    preview = await board_cog.send_posts(channel, post, board=board, guide=guide)
+                    self.remember_preview(msg, board, url_post_id, preview)
             return
 
         if isinstance(search, str):
@@ -180,35 +204,43 @@ class Gallery(commands.Cog):
 
                 if should_cache:
                     print(f"Caching post #{test_post['id']}...")
-                    image_bytes = await utils.net.fetch_image(file_url)
-                    with open(os.path.join(file_cache_dir, file_name), 'wb') as image_file:
-                        shutil.copyfileobj(image_bytes, image_file)
+                    image_file = await utils.net.fetch_image(file_url, cache_path=file_path)
+
+                    if not image_file:
+                        parsed_posts.pop()
+                        continue
+
+                    image_file.close()
                 else:
                     print(f"Post #{test_post['id']} is already cached.")
 
-            print('Evaluating images...')
+            # the first post is the one the others are compared against
+            if parsed_posts and parsed_posts[0]['id'] == post['id']:
+                print('Evaluating images...')
 
-            ground_truth = parsed_posts[0]
-            for hash_func in [imagehash.phash, imagehash.dhash, imagehash.average_hash, imagehash.colorhash]:
-                if hash_func == imagehash.colorhash:
-                    hash_param = {'binbits': 6}
-                else:
-                    hash_param = {'hash_size': 16}
+                ground_truth = parsed_posts[0]
+                for hash_func in [imagehash.phash, imagehash.dhash, imagehash.average_hash, imagehash.colorhash]:
+                    if hash_func == imagehash.colorhash:
+                        hash_param = {'binbits': 6}
+                    else:
+                        hash_param = {'hash_size': 16}
 
-                ground_truth['hash'].append(hash_func(Image.open(ground_truth['path']), **hash_param))
+                    ground_truth['hash'].append(hash_func(Image.open(ground_truth['path']), **hash_param))
 
-                for parsed_post in parsed_posts[1:]:
-                    parsed_post['hash'].append(hash_func(Image.open(parsed_post['path']), **hash_param))
+                    for parsed_post in parsed_posts[1:]:
+                        parsed_post['hash'].append(hash_func(Image.open(parsed_post['path']), **hash_param))
 
-                    hash_diff = ground_truth['hash'][len(ground_truth['hash']) - 1] - parsed_post['hash'][len(parsed_post['hash']) - 1]
-                    parsed_post['score'].append(hash_diff)
+                        hash_diff = ground_truth['hash'][len(ground_truth['hash']) - 1] - parsed_post['hash'][len(parsed_post['hash']) - 1]
+                        parsed_post['score'].append(hash_diff)
 
-            print(f'Scores for post #{post_id}')
+                print(f'Scores for post #{post_id}')
 
-            for parsed_post in parsed_posts[1:]:
-                print('#' + str(parsed_post['id']), parsed_post['score'])
-                if sum(parsed_post['score']) <= 10:
-                    posts = posts[1:]
+                for parsed_post in parsed_posts[1:]:
+                    print('#' + str(parsed_post['id']), parsed_post['score'])
+                    if sum(parsed_post['score']) <= 10:
+                        posts = posts[1:]
+            else:
+                print(f'Unable to evaluate images for post #{post_id}')
 
         if first_post_missing_preview:
             if post['rating'] == 's' or on_nsfw_channel:
@@ -216,9 +248,11 @@ class Gallery(commands.Cog):
 
         if posts:
             if first_post_missing_preview:
-                await board_cog.send_posts(channel, posts, board=board, guide=guide, show_nsfw=on_nsfw_channel, max_posts=5)
+                preview = await board_cog.send_posts(channel, posts, board=board, guide=guide, show_nsfw=on_nsfw_channel, max_posts=5)
             else:
-                await board_cog.send_posts(channel, posts, board=board, guide=guide, show_nsfw=on_nsfw_channel)
+                preview = await board_cog.send_posts(channel, posts, board=board, guide=guide, show_nsfw=on_nsfw_channel)
+
+            self.remember_preview(msg, board, url_post_id, preview)
         else:
             if post['rating'] == 's' and not nsfw_culled or on_nsfw_channel:
                 print('Removed all duplicates')
@@ -240,11 +274,8 @@ class Gallery(commands.Cog):
         channel = msg.channel
         guide = kwargs.get('guide', self.bot.guides['gallery']['twitter-gallery'])
 
-        id_start = guide['post']['id_start']
-        id_end = guide['post']['id_end']
-
-        post_id = utils.posts.get_post_id(url, id_start, id_end)
-        if not post_id:
+        post_id = guide.get_post_id(url)
+        if not post_id or await self.is_repost(msg, 'twitter', post_id):
             return
 
         try:
@@ -280,6 +311,7 @@ class Gallery(commands.Cog):
             gallery_pics.append(f"{picture['media_url_https']}:orig")
 
         total_gallery_pics = len(gallery_pics)
+        preview = None
         for picture in gallery_pics:
             total_gallery_pics -= 1
 
@@ -303,7 +335,10 @@ class Gallery(commands.Cog):
                     text=guide['embed']['footer_text'] + " • Mobile-friendly viewer",
                     icon_url=self.bot.assets['twitter']['favicon'])
 
-            await channel.send(embed=embed)
+            sent_message = await channel.send(embed=embed)
+            preview = preview or sent_message
+
+        self.remember_preview(msg, 'twitter', post_id, preview)
 
     async def get_pixiv_gallery(self, msg, url):
         """Automatically fetch and post any image galleries from pixiv"""
@@ -311,7 +346,7 @@ class Gallery(commands.Cog):
         channel = msg.channel
 
         post_id = utils.posts.get_post_id(url, ['illust_id=', '/artworks/'], '&')
-        if not post_id:
+        if not post_id or await self.is_repost(msg, 'pixiv', post_id):
             return
 
         print(f'Now starting to process pixiv link #{post_id}')
@@ -360,6 +395,7 @@ class Gallery(commands.Cog):
                 pictures = [illust]
 
             total_to_preview = 5
+            preview = None
             for i, picture in enumerate(pictures[:total_to_preview]):
                 print(f'Retrieving picture #{post_id}...')
 
@@ -371,14 +407,13 @@ class Gallery(commands.Cog):
                 image_path = os.path.join(file_cache_dir, filename)
 
                 # cache file if it doesn't exist
-                image_bytes = None
+                image_file = None
                 if not os.path.exists(image_path):
                     print('Saving to cache...')
-                    image_bytes = await utils.net.fetch_image(url, headers=koakuma.bot.assets['pixiv']['headers'])
+                    image_file = await utils.net.fetch_image(url, headers=koakuma.bot.assets['pixiv']['headers'], cache_path=image_path)
 
-                    with open(os.path.join(file_cache_dir, filename), 'wb') as image_file:
-                        shutil.copyfileobj(image_bytes, image_file)
-                    image_bytes.seek(0)
+                    if not image_file:
+                        continue
 
                 if i + 1 >= min(total_to_preview, total_illust_pictures):
                     remaining_footer = ''
@@ -391,14 +426,17 @@ class Gallery(commands.Cog):
                     embed.set_footer(
                         text=remaining_footer,
                         icon_url=self.bot.assets['pixiv']['favicon'])
-                if image_bytes:
-                    await channel.send(file=discord.File(fp=image_bytes, filename=filename), embed=embed)
-                    image_bytes.close()
+                if image_file:
+                    sent_message = await channel.send(file=discord.File(fp=image_file, filename=filename), embed=embed)
+                    image_file.close()
                 else:
                     print('Uploading from cache...')
-                    await channel.send(file=discord.File(fp=image_path, filename=filename), embed=embed)
+                    sent_message = await channel.send(file=discord.File(fp=image_path, filename=filename), embed=embed)
+
+                preview = preview or sent_message
 
         await temp_message.delete()
+        self.remember_preview(msg, 'pixiv', post_id, preview)
         print('DONE PIXIV!')
 
     async def reauthenticate_pixiv(self):
@@ -453,7 +491,7 @@ class Gallery(commands.Cog):
         channel = msg.channel
 
         post_id = utils.posts.get_post_id(url, '/show/', '?')
-        if not post_id:
+        if not post_id or await self.is_repost(msg, 'sankaku', post_id):
             return
 
         search_url = f"{self.bot.assets['sankaku']['id_search_url']}{post_id}"
@@ -474,13 +512,18 @@ class Gallery(commands.Cog):
         image_filename = utils.net.get_url_filename(img_url)
         image = await utils.net.fetch_image(img_url)
 
+        if not image:
+            return
+
         embed = discord.Embed()
         embed.set_image(url=f"attachment://{image_filename}")
         embed.set_footer(
             text=self.bot.assets['sankaku']['name'],
             icon_url=self.bot.assets['sankaku']['favicon'])
 
-        await channel.send(file=discord.File(fp=image, filename=image_filename), embed=embed)
+        preview = await channel.send(file=discord.File(fp=image, filename=image_filename), embed=embed)
+        image.close()
+        self.remember_preview(msg, 'sankaku', post_id, preview)
 
     async def get_deviantart_post(self, msg, url):
         """Automatically fetch post from deviantart"""
@@ -488,7 +531,7 @@ class Gallery(commands.Cog):
         channel = msg.channel
 
         post_id = utils.posts.get_post_id(url, '/art/', r'[0-9]+$', has_regex=True)
-        if not post_id:
+        if not post_id or await self.is_repost(msg, 'deviantart', post_id):
             return
 
         search_url = self.bot.assets['deviantart']['search_url_extended'].format(post_id)
@@ -524,7 +567,8 @@ class Gallery(commands.Cog):
             text=self.bot.assets['deviantart']['name'],
             icon_url=self.bot.assets['deviantart']['favicon'])
 
-        await channel.send(embed=embed)
+        preview = await channel.send(embed=embed)
+        self.remember_preview(msg, 'deviantart', post_id, preview)
 
     async def get_imgur_gallery(self, msg, url):
         """Automatically fetch and post any image galleries from imgur"""
@@ -532,7 +576,7 @@ class Gallery(commands.Cog):
         channel = msg.channel
 
         album_id = utils.posts.get_post_id(url, ['/a/', '/gallery/'], '?')
-        if not album_id:
+        if not album_id or await self.is_repost(msg, 'imgur', album_id):
             return
 
         search_url = self.bot.assets['imgur']['album_url'].format(album_id)
@@ -547,6 +591,7 @@ class Gallery(commands.Cog):
             return
 
         pictures_processed = 0
+        preview = None
         for image in api_result['data'][1:5]:
             pictures_processed += 1
 
@@ -565,7 +610,10 @@ class Gallery(commands.Cog):
                     text=remaining_footer,
                     icon_url=self.bot.assets['imgur']['favicon']['size32'])
 
-            await channel.send(embed=embed)
+            sent_message = await channel.send(embed=embed)
+            preview = preview or sent_message
+
+        self.remember_preview(msg, 'imgur', album_id, preview)
 
 
 def setup(bot: commands.Bot):
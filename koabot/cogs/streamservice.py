@@ -70,6 +70,12 @@ class StreamService(commands.Cog):
             return
 
         channel_url = f'https://api.picarto.tv/api/v1/channel/name/{post_id}'
+
+        # don't bother if picarto has been failing to answer
+        if not utils.net.is_available(channel_url):
+            print('Skipping picarto preview, picarto is down.')
+            return
+
         picarto_request = (await utils.net.http_request(channel_url, json=True)).json
 
         if not picarto_request:
@@ -83,6 +89,10 @@ class StreamService(commands.Cog):
         image = await utils.net.fetch_image(picarto_request['thumbnails']['web'])
         filename = utils.net.get_url_filename(picarto_request['thumbnails']['web'])
 
+        if not image:
+            await channel.send(random.choice(self.bot.quotes['stream_preview_failed']))
+            return
+
         embed = discord.Embed()
         embed.set_author(
             name=post_id,
@@ -94,6 +104,7 @@ class StreamService(commands.Cog):
             text=self.bot.assets['picarto']['name'],
             icon_url=self.bot.assets['picarto']['favicon'])
         await channel.send(file=discord.File(fp=image, filename=filename), embed=embed)
+        image.close()
         return True
 
     @property
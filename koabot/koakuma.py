@@ -12,15 +12,54 @@ import discord
 from discord.ext import commands
 
 import koabot.tasks
+import koabot.utils.guides
+import koabot.utils.instances
+import koabot.utils.net
+
+
+class Koakuma(commands.Bot):
+    """Bot client that also owns the resources shared by the cogs"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # read from the config files in start()
+        self.koa = {}
+        self.assets = {}
+        self.auth_keys = {}
+        self.quotes = {}
+        self.rules = {}
+        self.tasks = {}
+        self.testing = {}
+        self.match_groups = {}
+
+        # set up in start()
+        self.launch_time = None
+        self.guide_loader = None
+        self.guides = None
+        self.net_session = None
+        self.instance_lease = None
+        self.sqlite_conn = None
+
+    async def close(self):
+        """Release the pooled network connections and the instance lease before logging out"""
+        if self.net_session:
+            await self.net_session.close()
+
+        if self.instance_lease:
+            self.instance_lease.release()
+
+        await super().close()
+
 
 intents = discord.Intents.default()
 intents.members = True
-intents.presences = True
 
-bot = commands.Bot(command_prefix='!', description='', intents=intents)
+bot = Koakuma(command_prefix='!', description='', intents=intents)
 
 SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
 BOT_DIRNAME = 'koa-bot'
+# every setting that goes directly under network in the config, the rest are under network.session
+NETWORK_SETTINGS = ['session', 'suffix_list', 'stats_dump_interval', 'preview_budget']
 
 DATA_DIR = appdirs.user_data_dir(BOT_DIRNAME)
 CONFIG_DIR = appdirs.user_config_dir(BOT_DIRNAME)
@@ -73,6 +112,10 @@ def run_periodic_tasks():
     """Bot routines"""
     bot.loop.create_task(koabot.tasks.check_live_streamers())
     bot.loop.create_task(koabot.tasks.change_presence_periodically())
+    bot.loop.create_task(koabot.tasks.dump_network_stats())
+    bot.loop.create_task(koabot.tasks.sweep_response_cache())
+    bot.loop.create_task(koabot.tasks.reload_guides())
+    bot.loop.create_task(koabot.tasks.renew_instance_lease())
 
 
 def load_all_extensions(path: str):
@@ -114,8 +157,8 @@ async def debug_check(ctx):
 
     beta_bot = ctx.guild.get_member(beta_bot_id)
 
-    # if the beta bot is online
-    if beta_bot and beta_bot.status == discord.Status.online:
+    # if the beta bot is running
+    if beta_bot and bot.instance_lease.beta_active:
         return ctx.guild.me.id == beta_bot_id
 
     return True
@@ -143,15 +186,51 @@ def start(debugging=False):
         'quotes.jsonc'
     ]
 
+    config_mtime = None
     for filename in data_filenames:
         try:
             with open(os.path.join(CONFIG_DIR, filename)) as json_file:
+                if filename == config_file:
+                    config_mtime = os.fstat(json_file.fileno()).st_mtime_ns
+
                 bot_data.update(commentjson.load(json_file))
         except FileNotFoundError as e:
             print(e)
 
     bot.__dict__.update(bot_data)
 
+    # Guides are compiled once here, and again only if the config file changes
+    bot.guide_loader = koabot.utils.guides.GuideLoader(os.path.join(CONFIG_DIR, config_file))
+    bot.guide_loader.update(bot_data, config_mtime)
+    bot.guides = bot.guide_loader.guides
+
+    # Every request made through koabot.utils.net reuses the same connection pool, set up from network.session
+    network_settings = bot.koa.get('network', {})
+    session_settings = dict(network_settings.get('session', {}))
+    rate_limits = session_settings['rate_limits'] = dict(session_settings.get('rate_limits', {}))
+
+    for key in network_settings:
+        if key not in NETWORK_SETTINGS:
+            print(f'Unknown setting "network.{key}", session settings go under "network.session"')
+
+    # sites can declare the rate limits of their hosts along with their assets
+    for site_assets in bot.assets.values():
+        if 'rate_limit' not in site_assets:
+            continue
+
+        for host in site_assets['rate_limit']['hosts']:
+            rate_limits.setdefault(host, site_assets['rate_limit'])
+
+    koabot.utils.net.load_suffix_list(network_settings.get('suffix_list'))
+    bot.net_session = koabot.utils.net.SessionManager(**session_settings)
+    koabot.utils.net.set_session_manager(bot.net_session)
+
+    # The live and beta instances find out about each other through a heartbeat instead of presences
+    bot.instance_lease = koabot.utils.instances.InstanceLease(
+        os.path.join(CACHE_DIR, 'instances.sqlite3'),
+        bot.koa['discord_user']['beta_id'],
+        **bot.koa.get('instance_lease', {}))
+
     print('Connecting to database...')
     start_load_time = timeit.default_timer()
 
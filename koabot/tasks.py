@@ -1,6 +1,8 @@
 """Routine tasks"""
 import asyncio
+import os
 import random
+import sqlite3
 from datetime import datetime
 
 import discord
@@ -8,6 +10,7 @@ import discord
 import koabot.utils as utils
 import koabot.utils.net
 from koabot import koakuma
+from koabot.utils.urls import DomainDispatcher
 
 
 async def check_live_streamers():
@@ -80,9 +83,15 @@ async def check_live_streamers():
             thumbnail_url = thumbnail_url.replace('{height}', '350')
             thumbnail_filename = utils.net.get_url_filename(thumbnail_url)
             image = await utils.net.fetch_image(thumbnail_url)
-            embed.set_image(url=f'attachment://{thumbnail_filename}')
+            announcement = {'message': f"{streamer['name']} is now live!", 'embed': embed}
 
-            stream_announcements.append({'message': f"{streamer['name']} is now live!", 'embed': embed, 'image': image, 'filename': thumbnail_filename})
+            if image:
+                embed.set_image(url=f'attachment://{thumbnail_filename}')
+                announcement.update({'image': image, 'filename': thumbnail_filename})
+            else:
+                embed.set_image(url=thumbnail_url)
+
+            stream_announcements.append(announcement)
 
         for channel in koakuma.bot.tasks['streamer_activity']['channels_to_announce_on']:
             for batch in stream_announcements:
@@ -115,6 +124,90 @@ async def change_presence_periodically():
         await asyncio.sleep(60 * 30)
 
 
+async def dump_network_stats():
+    """Periodically write the network and preview queue statistics to a file in the Prometheus text format"""
+
+    await koakuma.bot.wait_until_ready()
+
+    stats_path = os.path.join(koakuma.CACHE_DIR, 'netstats.prom')
+    dump_interval = koakuma.bot.koa.get('network', {}).get('stats_dump_interval', 60)
+
+    while not koakuma.bot.is_closed():
+        # replace the file in one go so that it's never read half written
+        with open(f'{stats_path}.tmp', 'w', encoding='utf-8') as stats_file:
+            stats_file.write(utils.net.get_session_manager().stats.to_prometheus())
+
+            events_cog = koakuma.bot.get_cog('BotEvents')
+            if events_cog:
+                stats_file.write(events_cog.link_jobs.to_prometheus('koabot_preview_jobs'))
+        os.replace(f'{stats_path}.tmp', stats_path)
+
+        await asyncio.sleep(dump_interval)
+
+
+async def sweep_response_cache():
+    """Keep the responses cached on disk from growing past their age and size limits"""
+
+    await koakuma.bot.wait_until_ready()
+
+    cache = utils.net.get_session_manager().cache
+
+    while not koakuma.bot.is_closed():
+        dropped = await cache.sweep()
+
+        if dropped:
+            print(f'Dropped {dropped} cached responses from disk')
+
+        await asyncio.sleep(cache.sweep_interval)
+
+
+async def renew_instance_lease():
+    """Keep the lease of this instance alive, and take note of whether the beta instance is running"""
+
+    await koakuma.bot.wait_until_ready()
+
+    instance_lease = koakuma.bot.instance_lease
+    # beat a few times per lease so that a single late beat doesn't count as going offline
+    beat_interval = instance_lease.ttl / 3
+
+    while not koakuma.bot.is_closed():
+        try:
+            instance_lease.beat(koakuma.bot.user.id)
+        except sqlite3.Error as e:
+            print(f'Could not renew the instance lease: {e}')
+
+        await asyncio.sleep(beat_interval)
+
+
+async def reload_guides():
+    """Compile the guides again whenever the config file changes, so that they can be edited without a restart"""
+
+    await koakuma.bot.wait_until_ready()
+
+    guide_loader = koakuma.bot.guide_loader
+    reload_interval = koakuma.bot.koa.get('guide_reload_interval', 10)
+
+    while not koakuma.bot.is_closed():
+        await asyncio.sleep(reload_interval)
+
+        try:
+            if not guide_loader.reload():
+                continue
+        except Exception as e:
+            # anything wrong with the edited config must not take the running guides down with it
+            print(f'> {datetime.now()}\nKeeping the current guides, the config could not be reloaded: {e!r}')
+            continue
+
+        koakuma.bot.guides = guide_loader.guides
+        koakuma.bot.match_groups = guide_loader.match_groups
+
+        events_cog = koakuma.bot.get_cog('BotEvents')
+        if events_cog:
+            events_cog.domain_dispatcher = DomainDispatcher(guide_loader.match_groups)
+
+        print(f'Guides reloaded [{datetime.utcnow().replace(microsecond=0)} (UTC+0)]')
+
+
 async def lookup_pending_posts():
     """Every 5 minutes search for danbooru posts"""
 
@@ -0,0 +1,114 @@
+"""Keep track of how busy channels are"""
+import collections
+import time
+
+
+class ChannelActivity():
+    """Messages without embeds counted over a sliding window, in a ring of time buckets"""
+
+    __slots__ = ('counts', 'total', 'last_bucket', 'last_seen', 'warned')
+
+    def __init__(self, bucket_count: int):
+        self.counts = [0] * bucket_count
+        self.total = 0
+        self.last_bucket = 0
+        self.last_seen = 0
+        self.warned = False
+
+    def advance(self, bucket: int):
+        """Move the window forward to the given bucket, forgetting whatever fell out of it"""
+        bucket_count = len(self.counts)
+        elapsed = bucket - self.last_bucket
+
+        if elapsed >= bucket_count:
+            self.counts = [0] * bucket_count
+            self.total = 0
+        else:
+            for i in range(self.last_bucket + 1, bucket + 1):
+                self.total -= self.counts[i % bucket_count]
+                self.counts[i % bucket_count] = 0
+
+        self.last_bucket = max(self.last_bucket, bucket)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.warned = False
+
+
+class ActivityCounters():
+    """Counts the messages without embeds sent in each channel over the last `window` seconds
+
+    Every channel gets a ring of `buckets` counters, each holding a slice
+    of the window, so adding a message or reading a count doesn't depend
+    on how many messages there were. Channels that go quiet for longer
+    than the window are forgotten.
+
+    Keywords:
+        window::float
+            Seconds messages are counted for. Default is 600
+        buckets::int
+            Slices the window is split into. Default is 10
+        max_channels::int
+            Most channels kept track of at once. Default is 5000
+    """
+
+    def __init__(self, **kwargs):
+        self.window = kwargs.get('window', 600)
+        self.bucket_count = kwargs.get('buckets', 10)
+        self.bucket_seconds = self.window / self.bucket_count
+        self.max_channels = kwargs.get('max_channels', 5000)
+
+        # channel id -> activity, from least to most recently active
+        self.channels = collections.OrderedDict()
+
+    def get(self, channel_id: int):
+        """Get the activity of a channel, or None if it isn't being kept track of"""
+        activity = self.channels.get(channel_id)
+
+        if activity:
+            activity.advance(int(time.time() // self.bucket_seconds))
+
+        return activity
+
+    def count(self, channel_id: int):
+        """Get how many messages without embeds were sent in a channel within the window"""
+        activity = self.get(channel_id)
+        return activity.total if activity else 0
+
+    def add(self, channel_id: int, has_embeds: bool = False):
+        """Take note of a message sent in a channel. A message with embeds starts the count over.
+        Returns:
+            ChannelActivity
+        """
+        now = time.time()
+        bucket = int(now // self.bucket_seconds)
+        activity = self.channels.get(channel_id)
+
+        if activity:
+            self.channels.move_to_end(channel_id)
+        else:
+            activity = self.channels[channel_id] = ChannelActivity(self.bucket_count)
+            activity.last_bucket = bucket
+
+        activity.advance(bucket)
+        activity.last_seen = now
+
+        if has_embeds:
+            activity.reset()
+        else:
+            activity.counts[bucket % self.bucket_count] += 1
+            activity.total += 1
+
+        self.evict(now)
+        return activity
+
+    def evict(self, now: float):
+        """Forget the channels that have been idle for longer than the window"""
+        while self.channels:
+            channel_id, activity = next(iter(self.channels.items()))
+
+            if now - activity.last_seen < self.window and len(self.channels) <= self.max_channels:
+                break
+
+            del self.channels[channel_id]
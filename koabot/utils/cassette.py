@@ -0,0 +1,184 @@
+"""Record http exchanges and play them back without a network"""
+import asyncio
+import hashlib
+import os
+import pickle
+
+from multidict import CIMultiDict
+
+import koabot.koakuma
+
+# Environment variables that take precedence over the cassette settings in the config
+MODE_ENV_VAR = 'KOAKUMA_CASSETTE_MODE'
+DIRECTORY_ENV_VAR = 'KOAKUMA_CASSETTE_DIR'
+LATENCY_ENV_VAR = 'KOAKUMA_CASSETTE_LATENCY'
+
+
+class Cassette():
+    """Records the exchanges made through koabot.utils.net, or plays them back
+
+    Keywords:
+        mode::str
+            'record' to save every exchange, 'replay' to answer every request from the saved ones.
+            Anything else leaves the network alone. Overridden by $KOAKUMA_CASSETTE_MODE
+        directory::str
+            Where the exchanges are saved. Default is CACHE_DIR/cassettes. Overridden by $KOAKUMA_CASSETTE_DIR
+        latency::float or str
+            Seconds every replayed response is delayed by, or 'recorded' to take as long as the original did.
+            Default is 0. Overridden by $KOAKUMA_CASSETTE_LATENCY
+    """
+
+    def __init__(self, **kwargs):
+        self.mode = os.environ.get(MODE_ENV_VAR, kwargs.get('mode'))
+        self.directory = os.environ.get(DIRECTORY_ENV_VAR, kwargs.get('directory')) or os.path.join(koabot.koakuma.CACHE_DIR, 'cassettes')
+
+        latency = os.environ.get(LATENCY_ENV_VAR, kwargs.get('latency', 0))
+
+        try:
+            self.latency = latency if latency == 'recorded' else float(latency)
+        except (TypeError, ValueError):
+            print(f'Invalid cassette latency "{latency}", replaying without any')
+            self.latency = 0
+
+    @property
+    def recording(self):
+        """Whether or not exchanges are being saved"""
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        """Whether or not requests are answered from the saved exchanges"""
+        return self.mode == 'replay'
+
+    @staticmethod
+    def make_key(method: str, url: str, data=None):
+        """Identify an exchange by its method, url and body
+        Credentials are left out on purpose, they change between recording and replaying.
+        """
+        if isinstance(data, dict):
+            data = sorted(data.items())
+
+        return hashlib.sha256(repr((method, url, data)).encode()).hexdigest()
+
+    def record(self, method: str, url: str, response, body: bytes, elapsed: float, **kwargs):
+        """Save an exchange
+        Arguments:
+            method::str
+            url::str
+            response::aiohttp.ClientResponse
+                The response as it was received
+            body::bytes
+                Everything that was read from the response
+            elapsed::float
+                Seconds the exchange took
+
+        Keywords:
+            data
+                The body of the request
+        """
+        entry = {
+            'method': method,
+            'url': url,
+            'status': response.status,
+            'reason': response.reason,
+            'headers': list(response.headers.items()),
+            'body': body,
+            'elapsed': elapsed
+        }
+
+        file_path = os.path.join(self.directory, self.make_key(method, url, kwargs.get('data')))
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(f'{file_path}.tmp', 'wb') as cassette_file:
+            pickle.dump(entry, cassette_file)
+        os.replace(f'{file_path}.tmp', file_path)
+
+    async def play(self, method: str, url: str, **kwargs):
+        """Answer a request with the exchange that was recorded for it
+        Keywords:
+            data
+                The body of the request
+
+        Returns:
+            RecordedResponse
+                A 404 if nothing was recorded for the request
+        """
+        file_path = os.path.join(self.directory, self.make_key(method, url, kwargs.get('data')))
+
+        try:
+            with open(file_path, 'rb') as cassette_file:
+                entry = pickle.load(cassette_file)
+        except FileNotFoundError:
+            print(f'Nothing was recorded for {method} {url}')
+            entry = {'url': url, 'status': 404, 'reason': 'Not Recorded', 'headers': [], 'body': b'', 'elapsed': 0}
+
+        if self.latency == 'recorded':
+            await asyncio.sleep(entry['elapsed'])
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+
+        return RecordedResponse(entry)
+
+    def wrap(self, response):
+        """Wrap a live response so that whatever is read from it can be recorded"""
+        return RecordingResponse(response)
+
+
+class RecordedResponse():
+    """Stand-in for aiohttp.ClientResponse that plays back a recorded exchange"""
+
+    def __init__(self, entry: dict):
+        self.status = entry['status']
+        self.reason = entry['reason']
+        self.headers = CIMultiDict(entry['headers'])
+        self.url = entry['url']
+        self.real_url = entry['url']
+        self.content_length = len(entry['body'])
+        self.content = self
+        self._body = entry['body']
+
+    async def read(self):
+        """Get the whole recorded body"""
+        return self._body
+
+    async def iter_chunked(self, n: int):
+        """Go through the recorded body n bytes at a time"""
+        for i in range(0, len(self._body), n):
+            yield self._body[i:i + n]
+
+    def release(self):
+        """Nothing to give back, there's no connection"""
+
+
+class RecordingResponse():
+    """Proxy to aiohttp.ClientResponse that keeps a copy of everything read from it"""
+
+    def __init__(self, response):
+        self._response = response
+        self.chunks = []
+        self.content = self
+        # only a body that was read to the end is worth recording
+        self.complete = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    @property
+    def body(self):
+        """Everything that was read so far"""
+        return b''.join(self.chunks)
+
+    async def read(self):
+        """Read the whole body, keeping a copy"""
+        body = await self._response.read()
+        self.chunks = [body]
+        self.complete = True
+        return body
+
+    async def iter_chunked(self, n: int):
+        """Go through the body n bytes at a time, keeping a copy of every chunk"""
+        async for chunk in self._response.content.iter_chunked(n):
+            self.chunks.append(chunk)
+            yield chunk
+
+        self.complete = True
@@ -0,0 +1,67 @@
+"""Circuit breaker to stop waiting on services that are down"""
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker():
+    """Stops letting calls through after too many consecutive failures
+
+    While closed everything goes through. Once `failure_threshold` calls in a
+    row fail the circuit opens and every call is refused on the spot. After
+    `reset_timeout` seconds a single call is let through as a probe
+    (half-open): if it succeeds the circuit closes again, otherwise it reopens.
+
+    Arguments:
+        failure_threshold::int
+            Consecutive failures that open the circuit
+        reset_timeout::float
+            Seconds the circuit stays open before probing
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self.rejections = 0
+
+    @property
+    def available(self):
+        """Whether or not a call would be let through right now"""
+        return self.state == CLOSED or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow(self):
+        """Ask to let a call through. A call that's let through must report back how it went."""
+        if self.state == CLOSED:
+            return True
+
+        # the caller becomes the probe, everyone else keeps waiting
+        # a probe that never reports back is replaced after another timeout
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self.opened_at = time.monotonic()
+            return True
+
+        self.rejections += 1
+        return False
+
+    def record_success(self):
+        """Report that a call went through fine, closing the circuit"""
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """Report that a call failed, opening the circuit if it was the probe or one failure too many"""
+        self.failures += 1
+
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+
+            self.state = OPEN
+            self.opened_at = time.monotonic()
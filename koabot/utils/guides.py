@@ -0,0 +1,186 @@
+"""Compile the guides of the config into read-only objects"""
+import dataclasses
+import os
+import re
+import types
+import typing
+from datetime import datetime
+
+import commentjson
+from mergedeep import merge
+
+import koabot.utils.posts
+
+
+def freeze(value):
+    """Make a read-only copy of parsed json"""
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: freeze(v) for k, v in value.items()})
+
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+
+    return value
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class Guide():
+    """A guide with its inheritance already resolved
+
+    Sections are read like they are in the config, e.g. guide['api']['id_search_url'],
+    but can't be changed. Copy them before making changes. Use Guide.from_data to make one.
+    """
+
+    __slots__ = ('type', 'name', 'sections', 'id_start', 'id_end', 'id_end_pattern')
+
+    type: str
+    name: str
+    sections: types.MappingProxyType
+    id_start: tuple
+    id_end: object
+    id_end_pattern: typing.Optional[typing.Pattern]
+
+    @classmethod
+    def from_data(cls, guide_type: str, name: str, data: dict):
+        """Compile the contents of a guide
+        Arguments:
+            guide_type::str
+            name::str
+            data::dict
+                The contents of the guide, merged with the ones it inherits
+
+        Returns:
+            Guide
+
+        Raises:
+            ValueError
+                If post.id_end isn't a valid regular expression
+        """
+        post = data.get('post', {})
+        id_start = post.get('id_start', ())
+        id_end = post.get('id_end')
+
+        try:
+            id_end_pattern = re.compile(id_end) if isinstance(id_end, str) else None
+        except re.error as e:
+            raise ValueError(f'Guide "{guide_type}/{name}" has an invalid post.id_end: {e}') from None
+
+        return cls(guide_type, name, freeze(data), (id_start,) if isinstance(id_start, str) else tuple(id_start), id_end, id_end_pattern)
+
+    def __getitem__(self, key: str):
+        return self.sections[key]
+
+    def __contains__(self, key: str):
+        return key in self.sections
+
+    def get(self, key: str, default=None):
+        return self.sections.get(key, default)
+
+    def __repr__(self):
+        return f'<Guide {self.type}/{self.name}>'
+
+    def get_post_id(self, url: str, has_regex: bool = False):
+        """Get the post id from an url, using the id_start and id_end of the guide
+        Arguments:
+            url::str
+            has_regex::bool
+                Whether or not id_end is regex. Default is False
+        """
+        trim_to = self.id_end_pattern if has_regex else self.id_end
+        return koabot.utils.posts.get_post_id(url, list(self.id_start), trim_to, has_regex=has_regex)
+
+
+def compile_guides(raw_guides: dict):
+    """Resolve the inheritance of every guide and compile them
+    Arguments:
+        raw_guides::dict
+            The guides of the config, by type and name
+
+    Returns:
+        types.MappingProxyType
+            The compiled guides, by type and name
+    """
+    resolved = {}
+
+    def resolve(guide_type: str, name: str, chain: tuple = ()):
+        if (guide_type, name) in resolved:
+            return resolved[(guide_type, name)]
+
+        if (guide_type, name) in chain:
+            raise ValueError(f'Guide "{guide_type}/{name}" inherits from itself')
+
+        try:
+            guide_content = raw_guides[guide_type][name]
+        except KeyError:
+            raise ValueError(f'"{chain[-1][0]}/{chain[-1][1]}" inherits from "{guide_type}/{name}", which is undefined') from None
+
+        if 'inherits' in guide_content:
+            guide_to_inherit = guide_content['inherits'].split('/')
+
+            if len(guide_to_inherit) > 1:
+                target_guide = resolve(guide_to_inherit[0], guide_to_inherit[1], chain + ((guide_type, name),))
+            else:
+                target_guide = resolve(guide_type, guide_to_inherit[0], chain + ((guide_type, name),))
+
+            guide_content = merge({}, target_guide, guide_content)
+
+        resolved[(guide_type, name)] = guide_content
+        return guide_content
+
+    guides = {}
+    for guide_type, v in raw_guides.items():
+        compiled = {}
+
+        for name in v:
+            try:
+                compiled[name] = Guide.from_data(guide_type, name, resolve(guide_type, name))
+            except ValueError as e:
+                # leave out just this guide, the rest of the config is still usable
+                print(f'> {datetime.now()}\nSkipping a guide: {e}')
+
+        guides[guide_type] = types.MappingProxyType(compiled)
+
+    return types.MappingProxyType(guides)
+
+
+class GuideLoader():
+    """Keeps the compiled guides of a config file, compiling them again only when the file changes
+
+    Arguments:
+        config_path::str
+            The config file the guides and match groups are read from
+    """
+
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self.mtime = None
+        self.guides = None
+        self.match_groups = None
+
+    def update(self, config: dict, mtime: int):
+        """Compile the guides of an already parsed config
+        Arguments:
+            config::dict
+            mtime::int
+                Modification time of the file it was parsed from, in nanoseconds
+        """
+        self.guides = compile_guides(config.get('guides', {}))
+        self.match_groups = config.get('match_groups', {})
+        self.mtime = mtime
+
+    def reload(self):
+        """Read the config file again if it changed since it was last read
+        Returns:
+            bool
+                Whether or not the guides were compiled again
+        """
+        mtime = os.stat(self.config_path).st_mtime_ns
+
+        if mtime == self.mtime:
+            return False
+
+        with open(self.config_path, encoding='utf-8') as json_file:
+            config = commentjson.load(json_file)
+
+        self.update(config, mtime)
+        return True
@@ -0,0 +1,60 @@
+"""Tell the live and beta instances apart without watching presences"""
+import sqlite3
+import time
+
+
+class InstanceLease():
+    """Heartbeat shared through a SQLite file by the instances running on the same machine
+
+    Every instance keeps renewing a row of its own with the time it was
+    last alive. An instance counts as active until its row is older than
+    `ttl`, or is removed when it shuts down. Whether the beta instance
+    is active is worked out on every beat and kept, so asking is free.
+
+    Arguments:
+        path::str
+            The SQLite file both instances share
+        beta_id::int
+            User id of the beta instance
+
+    Keywords:
+        ttl::float
+            Seconds an instance counts as active after its last beat. Default is 15
+    """
+
+    def __init__(self, path: str, beta_id: int, **kwargs):
+        self.beta_id = beta_id
+        self.ttl = kwargs.get('ttl', 15)
+        self.instance_id = None
+        self.beta_active = False
+
+        # each instance has its own connection, they only ever wait on each other briefly
+        self.conn = sqlite3.connect(path, timeout=1)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS instanceLeases (instanceId INTEGER PRIMARY KEY, beatAt REAL NOT NULL)')
+        self.conn.commit()
+
+    def beat(self, instance_id: int):
+        """Renew the lease of this instance and check on the beta one
+        Returns:
+            bool
+                Whether or not the beta instance is active
+        """
+        self.instance_id = instance_id
+        now = time.time()
+
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO instanceLeases (instanceId, beatAt) VALUES (?, ?)', (instance_id, now))
+            row = self.conn.execute('SELECT beatAt FROM instanceLeases WHERE instanceId = ?', (self.beta_id,)).fetchone()
+
+        self.beta_active = bool(row) and now - row[0] < self.ttl
+        return self.beta_active
+
+    def release(self):
+        """Give up the lease of this instance, so that the other one takes over right away"""
+        if self.instance_id is None:
+            return
+
+        with self.conn:
+            self.conn.execute('DELETE FROM instanceLeases WHERE instanceId = ?', (self.instance_id,))
+
+        self.instance_id = None
@@ -0,0 +1,139 @@
+"""Bounded work queue shared fairly between guilds"""
+import asyncio
+import collections
+import time
+import traceback
+
+from koabot.utils.stats import Histogram
+
+
+class JobQueue():
+    """Runs jobs on a pool of workers, taking turns between the guilds that have jobs waiting
+
+    Jobs are kept in a queue per guild and the workers go round-robin
+    over the guilds, so a single busy guild can't starve everyone else.
+    Once the queue is full new jobs are dropped instead of piling up.
+
+    Keywords:
+        workers::int
+            Amount of jobs that run at the same time. Default is 4
+        max_size::int
+            Most jobs waiting across every guild. Default is 100
+        max_per_guild::int
+            Most jobs waiting for a single guild. Default is 20
+    """
+
+    # job counts since the bot started, exported as *_total
+    COUNTERS = ['submitted', 'dropped', 'completed', 'failed']
+
+    def __init__(self, **kwargs):
+        self.worker_count = kwargs.get('workers', 4)
+        self.max_size = kwargs.get('max_size', 100)
+        self.max_per_guild = kwargs.get('max_per_guild', 20)
+
+        # guild id -> jobs waiting, in the order the guilds take turns
+        self.queues = collections.OrderedDict()
+        self.size = 0
+        self.workers = []
+        self.pending = None
+
+        # jobs queued, turned away because the queue was full, and how the ones that ran ended
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+        # seconds jobs spent waiting for a worker, and running
+        self.wait = Histogram()
+        self.run = Histogram()
+
+    def start(self):
+        """Start the workers"""
+        self.pending = asyncio.Semaphore(0)
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(self.worker_count)]
+
+    def close(self):
+        """Stop the workers, forgetting every job still waiting"""
+        for worker in self.workers:
+            worker.cancel()
+
+        self.workers = []
+        self.queues.clear()
+        self.size = 0
+
+    def submit(self, guild_id: int, func, *args, **kwargs):
+        """Queue a coroutine function to be called by a worker
+        Returns:
+            bool
+                False if the queue was full and the job was dropped
+        """
+        queue = self.queues.get(guild_id)
+
+        if self.size >= self.max_size or queue and len(queue) >= self.max_per_guild:
+            self.dropped += 1
+            return False
+
+        if not self.workers:
+            self.start()
+
+        if queue is None:
+            queue = self.queues[guild_id] = collections.deque()
+
+        queue.append((time.monotonic(), func, args, kwargs))
+        self.size += 1
+        self.submitted += 1
+        self.pending.release()
+        return True
+
+    def next_job(self):
+        """Take the oldest job of the guild whose turn it is"""
+        guild_id, queue = next(iter(self.queues.items()))
+        job = queue.popleft()
+
+        # go to the back of the line, or leave it if there's nothing left
+        if queue:
+            self.queues.move_to_end(guild_id)
+        else:
+            del self.queues[guild_id]
+
+        self.size -= 1
+        return job
+
+    async def work(self):
+        while True:
+            await self.pending.acquire()
+            submitted_at, func, args, kwargs = self.next_job()
+            started_at = time.monotonic()
+            self.wait.observe(started_at - submitted_at)
+
+            try:
+                await func(*args, **kwargs)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                traceback.print_exc()
+            finally:
+                self.run.observe(time.monotonic() - started_at)
+
+    def summary(self):
+        """Get a human readable line of how the queue is doing"""
+        return (f'depth {self.size}/{self.max_size} over {len(self.queues)} guilds, '
+                f'{self.submitted} submitted, {self.dropped} dropped, {self.completed} completed, {self.failed} failed, '
+                f'wait p95 {self.wait.quantile(0.95) * 1000:0.0f}ms, run p95 {self.run.quantile(0.95) * 1000:0.0f}ms')
+
+    def to_prometheus(self, prefix: str):
+        """Get every statistic in the Prometheus text format"""
+        lines = []
+
+        for counter in self.COUNTERS:
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            lines.append(f'{prefix}_{counter}_total {getattr(self, counter)}')
+
+        lines.append(f'# TYPE {prefix}_depth gauge')
+        lines.append(f'{prefix}_depth {self.size}')
+
+        for histogram in ['wait', 'run']:
+            lines.append(f'# TYPE {prefix}_{histogram}_seconds histogram')
+            lines.extend(getattr(self, histogram).to_prometheus(f'{prefix}_{histogram}_seconds'))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,26 @@
+"""Message utilities"""
+
+
+class MessageFeatures():
+    """What a message has in it, worked out once with cheap checks so the stages it doesn't need can be skipped
+
+    Arguments:
+        msg::discord.Message
+        prefix::str
+            The command prefix of the bot
+    """
+
+    __slots__ = ('has_urls', 'has_channel_mentions', 'has_prefix', 'has_attachments')
+
+    def __init__(self, msg, prefix: str):
+        content = msg.content
+        # a message without these can't hold a url or a channel mention, but having them is not a guarantee
+        self.has_urls = 'http' in content
+        self.has_channel_mentions = '<#' in content
+        self.has_prefix = content.startswith(prefix)
+        self.has_attachments = bool(msg.attachments)
+
+    @property
+    def is_plain(self):
+        """Whether or not the message is just chat with nothing to act on"""
+        return not (self.has_urls or self.has_channel_mentions or self.has_prefix or self.has_attachments)
@@ -1,12 +1,314 @@
 """Handle network requests"""
-import io
+import asyncio
+import collections
+import contextlib
+import contextvars
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
 from datetime import datetime
 
 import aiohttp
+import tldextract
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import koabot.koakuma
+from koabot.utils.cassette import Cassette
+from koabot.utils.circuit import CircuitBreaker
+from koabot.utils.ratelimit import TokenBucket
+from koabot.utils.stats import NetStats
+
+# Seconds responses stay fresh in the response cache, by host
+# Hosts not listed here are never cached unless configured otherwise
+DEFAULT_CACHE_TTL = {
+    'danbooru.donmai.us': 60 * 5,
+    'safebooru.donmai.us': 60 * 5,
+    'e621.net': 60 * 5,
+    'e926.net': 60 * 5,
+    'jisho.org': 60 * 60 * 24,
+    'api.urbandictionary.com': 60 * 60,
+    'www.dictionaryapi.com': 60 * 60 * 24,
+    'en.wikipedia.org': 60 * 60,
+    'api.picarto.tv': 30
+}
+
+# Request headers that make two requests to the same url different
+CACHE_KEY_HEADERS = ['accept', 'accept-language', 'authorization', 'client-id', 'content-type']
+
+# Response headers worth keeping along with a cached body
+CACHE_STORED_HEADERS = ['content-type', 'etag', 'last-modified']
+
+# Requests per second allowed by each host, and how many can be sent at once
+# Hosts not listed here are only limited by the connection pool
+DEFAULT_RATE_LIMITS = {
+    'danbooru.donmai.us': {'per_second': 10, 'burst': 10},
+    'safebooru.donmai.us': {'per_second': 10, 'burst': 10},
+    'e621.net': {'per_second': 2, 'burst': 2},
+    'e926.net': {'per_second': 2, 'burst': 2},
+    'api.twitch.tv': {'per_second': 13, 'burst': 30},
+    'api.imgur.com': {'per_second': 1, 'burst': 5}
+}
+
+# Methods that can be safely sent more than once
+IDEMPOTENT_METHODS = ['GET', 'HEAD']
+
+# Statuses worth retrying a request over
+RETRY_STATUSES = [429, 500, 502, 503, 504, 524]
+
+# Bytes read at a time when downloading images
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# Placeholder for json that hasn't been decoded yet, since None is valid json
+_UNDECODED = object()
+
+_session_manager = None
+_tld_extractor = None
+
+# Point in time (monotonic) by which every request of the current task must be done
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class SessionManager():
+    """Long-lived connection pool shared by every request the bot makes
+
+    The bot sets it up from the network.session section of its config.
+
+    Keywords:
+        limit::int
+            Maximum amount of simultaneous connections. Default is 100
+        limit_per_host::int
+            Maximum amount of simultaneous connections to the same host. Default is 8
+        keepalive_timeout::int
+            Seconds an idle connection is kept open for reuse. Default is 30
+        dns_cache_ttl::int
+            Seconds a resolved host is remembered for. Default is 300
+        max_image_size::int
+            Largest image in bytes fetch_image will download. Default is 8 MiB, Discord's upload limit
+        image_spool_size::int
+            Images bigger than this many bytes are spooled to a temporary file while downloading. Default is 1 MiB
+        rate_limits::dict
+            Token bucket settings by host, as in DEFAULT_RATE_LIMITS, which they are merged over
+        max_retries::int
+            Times an idempotent request is retried. Default is 2
+        retry_base_delay::float
+            Seconds the exponential backoff starts from. Default is 0.5
+        retry_max_delay::float
+            Most seconds waited between retries. Default is 10
+        max_retry_after::float
+            Longest Retry-After in seconds that is worth waiting for. Default is 30
+        request_timeout::float
+            Most seconds a single request may take, body included. Default is 20
+        circuit_failure_threshold::int
+            Consecutive failures after which a host is considered down. Default is 5
+        circuit_reset_timeout::float
+            Seconds a host that's down is left alone before trying it again. Default is 30
+        cache::dict
+            Keywords for the ResponseCache
+        cassette::dict
+            Keywords for the Cassette, to record or replay every exchange
+    """
+
+    def __init__(self, **kwargs):
+        self.limit = kwargs.get('limit', 100)
+        self.limit_per_host = kwargs.get('limit_per_host', 8)
+        self.keepalive_timeout = kwargs.get('keepalive_timeout', 30)
+        self.dns_cache_ttl = kwargs.get('dns_cache_ttl', 300)
+        self.max_image_size = kwargs.get('max_image_size', 8 * 1024 * 1024)
+        self.image_spool_size = kwargs.get('image_spool_size', 1024 * 1024)
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS)
+        self.rate_limits.update(kwargs.get('rate_limits', {}))
+        self.max_retries = kwargs.get('max_retries', 2)
+        self.retry_base_delay = kwargs.get('retry_base_delay', 0.5)
+        self.retry_max_delay = kwargs.get('retry_max_delay', 10)
+        self.max_retry_after = kwargs.get('max_retry_after', 30)
+        self.request_timeout = kwargs.get('request_timeout', 20)
+        self.circuit_failure_threshold = kwargs.get('circuit_failure_threshold', 5)
+        self.circuit_reset_timeout = kwargs.get('circuit_reset_timeout', 30)
+        self.limiters = {}
+        self.breakers = {}
+        self.cache = ResponseCache(**kwargs.get('cache', {}))
+        self.cassette = Cassette(**kwargs.get('cassette', {}))
+        self.in_flight = {}
+        self.stats = NetStats()
+        self._session = None
+
+    @property
+    def closed(self):
+        return self._session is None or self._session.closed
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Get the shared session, opening it if it isn't already
+        Must be called from within the running event loop.
+        """
+        if self.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl)
+
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_start.append(self._on_connection_create_start)
+            trace_config.on_connection_create_end.append(self._on_connection_create_end)
+            trace_config.on_request_chunk_sent.append(self._on_request_chunk_sent)
+            trace_config.on_response_chunk_received.append(self._on_response_chunk_received)
+
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+        return self._session
+
+    async def _on_connection_create_start(self, _session, context, _params):
+        context.connect_started_at = time.monotonic()
+
+    async def _on_connection_create_end(self, _session, context, _params):
+        self.stats.get(context.trace_request_ctx['host']).connect.observe(time.monotonic() - context.connect_started_at)
+
+    async def _on_request_chunk_sent(self, _session, context, params):
+        self.stats.get(context.trace_request_ctx['host']).bytes_out += len(params.chunk)
+
+    async def _on_response_chunk_received(self, _session, context, params):
+        self.stats.get(context.trace_request_ctx['host']).bytes_in += len(params.chunk)
+
+    def get_limiter(self, url: str):
+        """Get the rate limiter of the host of an url, or None if it isn't limited"""
+        host = get_domain(url)
+
+        if host not in self.limiters:
+            settings = self.rate_limits.get(host)
+
+            if settings:
+                self.limiters[host] = TokenBucket(settings['per_second'], settings.get('burst', settings['per_second']))
+            else:
+                self.limiters[host] = None
+
+        return self.limiters[host]
+
+    def get_breaker(self, url: str) -> CircuitBreaker:
+        """Get the circuit breaker of the host of an url"""
+        host = get_domain(url)
+
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.circuit_failure_threshold, self.circuit_reset_timeout)
+
+        return self.breakers[host]
+
+    def get_backoff(self, attempt: int):
+        """Get a random delay that grows exponentially with every attempt"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def get_retry_delay(self, response: aiohttp.ClientResponse, attempt: int, retries: int):
+        """Get how long to wait before retrying a request, or None if it shouldn't be retried"""
+        retry_after = None
+
+        if response.status == 429:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            limiter = self.get_limiter(str(response.url))
+
+            # everyone else talking to this host needs to hold back too, but not for longer than a retry would
+            if limiter and retry_after:
+                limiter.block(min(retry_after, self.max_retry_after))
+
+        if attempt >= retries or response.status not in RETRY_STATUSES:
+            return None
+
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+
+            return retry_after + random.uniform(0, self.retry_base_delay)
+
+        return self.get_backoff(attempt)
+
+    def land_flight(self, request_key: str, flight: asyncio.Future):
+        """Forget a finished in-flight request so the next one goes out again"""
+        self.in_flight.pop(request_key, None)
+
+        # the exception is re-raised to whoever awaited it, this is just so nobody warns about it
+        if not flight.cancelled():
+            flight.exception()
+
+    async def close(self):
+        """Close the shared session and all of its pooled connections"""
+        if not self.closed:
+            await self._session.close()
+
+        self._session = None
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Give every request made within the block a shared time budget
+    A deadline set inside another one can only make the budget shorter.
+    """
+    new_deadline = time.monotonic() + seconds
+    current_deadline = _deadline.get()
+
+    if current_deadline is not None:
+        new_deadline = min(new_deadline, current_deadline)
+
+    token = _deadline.set(new_deadline)
+
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_time_left():
+    """Get the seconds left before the current deadline, or None if there's no deadline"""
+    current_deadline = _deadline.get()
+
+    if current_deadline is None:
+        return None
+
+    return current_deadline - time.monotonic()
+
+
+def fits_deadline(seconds: float):
+    """Whether or not there's time to wait the given seconds before the current deadline"""
+    time_left = get_time_left()
+    return time_left is None or seconds < time_left
+
+
+async def run_within_deadline(coro, seconds: float):
+    """Run a coroutine under a deadline, cancelling whatever it's still doing once the time runs out
+    Raises asyncio.TimeoutError if it didn't finish in time.
+    """
+    with deadline(seconds):
+        return await asyncio.wait_for(coro, timeout=get_time_left())
+
+
+def set_session_manager(manager: SessionManager):
+    """Make every request go through the given session manager"""
+    global _session_manager
+    _session_manager = manager
+
+
+def get_session_manager() -> SessionManager:
+    """Get the session manager in use, making a default one if none was set"""
+    if _session_manager is None:
+        set_session_manager(SessionManager())
+
+    return _session_manager
 
 
 async def http_request(url: str, **kwargs):
     """Make an http request
+
+    Identical GET requests made while one is already on its way wait for
+    that one instead, and they all receive the same response.
+
     Arguments:
         url::str
             The url to point to
@@ -20,19 +322,279 @@ async def http_request(url: str, **kwargs):
             object containing headers
         post::bool
             whether or not the request is a POST request
+        json::bool
+            No longer needed, the body is decoded as json the first time NetResponse.json is read
+        cache::bool
+            Whether or not GET responses may be served from the response cache. Default is True
+        cache_ttl::int
+            Seconds a cached response stays fresh, overriding the host's configured ttl
+        coalesce::bool
+            Whether or not to share the response of an identical GET request in flight. Default is True
     """
     auth = kwargs.get('auth')
     headers = kwargs.get('headers')
     data = kwargs.get('data')
     post = kwargs.get('post')
 
-    async with aiohttp.ClientSession(auth=auth) as session:
-        if post:
-            async with session.post(url, data=data, headers=headers) as response:
-                return await handle_request(response, **kwargs)
+    if post:
+        return await _send_request('POST', url, **kwargs)
+
+    manager = get_session_manager()
+    cache = manager.cache
+    request_key = cache.make_key('GET', url, data=data, headers=headers, auth=auth)
+
+    cache_ttl = 0
+    if kwargs.get('cache', True):
+        cache_ttl = kwargs.get('cache_ttl', cache.get_ttl(url))
+
+    if cache_ttl:
+        cached_entry = await cache.get(request_key)
+
+        if cached_entry and time.time() - cached_entry['stored_at'] < cache_ttl:
+            manager.stats.get(get_domain(url)).cache_hits += 1
+            return cache.to_response(cached_entry)
+
+    if not kwargs.get('coalesce', True):
+        return await _send_request('GET', url, cache_key=cache_ttl and request_key, **kwargs)
+
+    flight = manager.in_flight.get(request_key)
+
+    if flight:
+        manager.stats.get(get_domain(url)).coalesced += 1
+    else:
+        # run as its own task so that a caller giving up doesn't cancel it for everyone else,
+        # and outside of the caller's deadline, which the others don't share
+        token = _deadline.set(None)
+
+        try:
+            flight = asyncio.ensure_future(_send_request('GET', url, cache_key=cache_ttl and request_key, **kwargs))
+        finally:
+            _deadline.reset(token)
+
+        manager.in_flight[request_key] = flight
+        flight.add_done_callback(lambda f: manager.land_flight(request_key, f))
+
+    time_left = get_time_left()
+
+    if time_left is None:
+        return await asyncio.shield(flight)
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(flight), timeout=max(0, time_left))
+    except asyncio.TimeoutError:
+        print(f'> {datetime.now()}\nOut of time waiting for {url} "{kwargs.get("err_msg")}"')
+        return NetResponse(504, url=url)
+
+
+async def _send_request(method: str, url: str, **kwargs):
+    """Send a request through the shared session
+    Arguments:
+        method::str
+            'GET' or 'POST'
+        url::str
+            The url to point to
+
+    Keywords:
+        cache_key::str
+            Key to revalidate and store the response with. Not cached if unset
+        Any other keyword is the same as in http_request
+    """
+    auth = kwargs.get('auth')
+    headers = kwargs.get('headers')
+    data = kwargs.get('data')
+    cache_key = kwargs.get('cache_key')
+
+    manager = get_session_manager()
+    cache = manager.cache
+    cached_entry = None
+
+    if cache_key:
+        cached_entry = await cache.get(cache_key)
+
+        # a recorded 304 would be useless to replay without the same cache
+        if cached_entry and not manager.cassette.recording:
+            # stale, but the server might confirm that it's still valid
+            headers = dict(headers or {})
+            headers.update(cache.get_validators(cached_entry))
+
+    try:
+        async with _open_request(method, url, auth=auth, data=data, headers=headers) as response:
+            if cached_entry and response.status == 304:
+                manager.stats.get(get_domain(url)).revalidations += 1
+                await cache.put(cache_key, cached_entry)
+                return cache.to_response(cached_entry)
+
+            net_response = await handle_request(response, **kwargs)
+    except CircuitOpenError:
+        print(f'> {datetime.now()}\nSkipped {url}\n{get_domain(url)} is down, not trying again for now "{kwargs.get("err_msg")}"')
+        return NetResponse(503, url=url)
+    except asyncio.TimeoutError as e:
+        print(f'> {datetime.now()}\nTimed out connecting to {url}\n{e!r} "{kwargs.get("err_msg")}"')
+        return NetResponse(504, url=url)
+    except aiohttp.ClientError as e:
+        print(f'> {datetime.now()}\nFailed connecting to {url}\n{e!r} "{kwargs.get("err_msg")}"')
+        return NetResponse(502, url=url)
+
+    if cache_key and net_response.status == 200:
+        await cache.put(cache_key, cache.to_entry(net_response))
+
+    return net_response
+
+
+@contextlib.asynccontextmanager
+async def _open_request(method: str, url: str, **kwargs):
+    """Open a request through the shared session, yielding its response
+
+    Waits for the host's rate limiter before sending anything. Idempotent
+    requests that fail to connect, time out or get a 429/5xx are retried
+    with jittered exponential backoff, or after the server's Retry-After.
+
+    Every request is bounded by the session manager's request_timeout and
+    by the deadline of the task, if any. Waits that wouldn't fit before the
+    deadline aren't waited.
+
+    Hosts that keep failing have their circuit opened, and requests to them
+    raise CircuitOpenError right away instead of waiting for another timeout.
+
+    If the session manager's cassette is replaying, nothing goes out to the
+    network and the recorded response is yielded instead.
+
+    Arguments:
+        method::str
+            The http method
+        url::str
+            The url to point to
+
+    Keywords:
+        auth::aiohttp.BasicAuth
+        data
+        headers::dict
+    """
+    manager = get_session_manager()
+    session = manager.get_session()
+    host = get_domain(url)
+    host_stats = manager.stats.get(host)
+    limiter = manager.get_limiter(url)
+    breaker = manager.get_breaker(url)
+    cassette = manager.cassette
+    retries = manager.max_retries if method in IDEMPOTENT_METHODS else 0
+    attempt = 0
+
+    while True:
+        if not breaker.allow():
+            host_stats.update_circuit(breaker)
+            raise CircuitOpenError(host)
+
+        if limiter:
+            wait = limiter.reserve()
+
+            if not fits_deadline(wait):
+                limiter.refund()
+                raise DeadlineExceeded(f'Out of time waiting for the rate limit of {host}')
+
+            if wait:
+                await asyncio.sleep(wait)
+
+        request_timeout = manager.request_timeout
+        time_left = get_time_left()
+
+        if time_left is not None:
+            if time_left <= 0:
+                raise DeadlineExceeded(f'Out of time before requesting {url}')
+
+            request_timeout = min(request_timeout, time_left)
+
+        host_stats.requests += 1
+        started_at = time.monotonic()
+
+        try:
+            if cassette.replaying:
+                response = await cassette.play(method, url, data=kwargs.get('data'))
+            else:
+                response = await session.request(
+                    method, url,
+                    auth=kwargs.get('auth'),
+                    data=kwargs.get('data'),
+                    headers=kwargs.get('headers'),
+                    timeout=aiohttp.ClientTimeout(total=request_timeout),
+                    trace_request_ctx={'host': host})
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            host_stats.errors += 1
+            breaker.record_failure()
+            host_stats.update_circuit(breaker)
+
+            delay = manager.get_backoff(attempt)
+
+            if attempt >= retries or not fits_deadline(delay):
+                raise
+            print(f'> {datetime.now()}\nRetrying {url} in {delay:0.1f}s\n{e!r}')
         else:
-            async with session.get(url, data=data, headers=headers) as response:
-                return await handle_request(response, **kwargs)
+            host_stats.ttfb.observe(time.monotonic() - started_at)
+            host_stats.statuses[response.status] += 1
+
+            # a response that's kept is only a success once its body arrives too
+            if response.status >= 500:
+                breaker.record_failure()
+                host_stats.update_circuit(breaker)
+
+            delay = manager.get_retry_delay(response, attempt, retries)
+
+            if delay is None or not fits_deadline(delay):
+                break
+
+            if response.status < 500:
+                breaker.record_success()
+                host_stats.update_circuit(breaker)
+
+            response.release()
+            host_stats.total.observe(time.monotonic() - started_at)
+            print(f'> {datetime.now()}\nRetrying {url} in {delay:0.1f}s\n[Network status {response.status}]: {response.reason}')
+
+        attempt += 1
+        await asyncio.sleep(delay)
+
+    if cassette.recording:
+        response = cassette.wrap(response)
+
+    body_failed = False
+
+    try:
+        yield response
+    except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        # the host stalled or dropped the connection halfway through the body
+        body_failed = True
+        raise
+    finally:
+        response.release()
+        elapsed = time.monotonic() - started_at
+        host_stats.total.observe(elapsed)
+
+        if body_failed:
+            host_stats.errors += 1
+            breaker.record_failure()
+        elif response.status < 500:
+            breaker.record_success()
+
+        host_stats.update_circuit(breaker)
+
+        # a download that was given up on or cut off would be replayed as if it were whole
+        if cassette.recording and response.complete:
+            cassette.record(method, url, response, response.body, elapsed, data=kwargs.get('data'))
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised instead of sending a request when the time budget of the task has run out"""
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open"""
+
+
+def is_available(url: str):
+    """Whether or not requests to the host of an url are being let through
+    Lets callers skip work that depends on a host that is currently down.
+    """
+    return get_session_manager().get_breaker(url).available
 
 
 async def handle_request(response: aiohttp.ClientResponse, **kwargs):
@@ -41,49 +603,381 @@ async def handle_request(response: aiohttp.ClientResponse, **kwargs):
         response::ClientResponse
 
     Keywords:
-        json::bool
-            true = must return json. false/unset = returns plain text
         err_msg::str
             message to display on failure
     """
-    json = kwargs.get('json')
     err_msg = kwargs.get('err_msg')
 
     if response.status != 200:
         # Timeout error
         # if response.status == 524
         print(f'> {datetime.now()}\nFailed connecting to {response.real_url}\n[Network status {response.status}]: {response.reason} "{err_msg}"')
-        return NetResponse(response)
+        return NetResponse(response.status, url=str(response.real_url), headers=response.headers)
 
-    if json:
-        response_body = await response.json(content_type=None)
-    else:
-        response_body = await response.read()
+    response_body = await response.read()
 
-    return NetResponse(response, response_body=response_body, **kwargs)
+    return NetResponse(response.status, url=str(response.real_url), headers=response.headers, body=response_body)
 
 
 class NetResponse():
-    """Custom network response class"""
+    """Custom network response class
 
-    def __init__(self, response: aiohttp.ClientResponse, **kwargs):
-        self.client_response = response
-        self.status = self.client_response.status
-        self.response_body = kwargs.get('response_body', None)
+    Only the raw body is kept. It's decoded as json the first time .json is
+    read, so a response that's shared or cached is never decoded twice.
 
-        if kwargs.get('json'):
-            self.json = self.response_body
-        elif kwargs.get('image'):
-            self.image = self.response_body
-        else:
-            self.plain_text = self.response_body
+    Arguments:
+        status::int
+            The http status code
+
+    Keywords:
+        url::str
+            The url that was finally reached
+        headers::dict
+            The response headers
+        body::bytes
+            The raw body of the response
+    """
+
+    __slots__ = ('status', 'url', 'headers', 'body', '_json')
+
+    def __init__(self, status: int, **kwargs):
+        self.status = status
+        self.url = kwargs.get('url')
+        self.headers = kwargs.get('headers', {})
+        self.body = kwargs.get('body', None)
+        self._json = _UNDECODED
+
+    @property
+    def json(self):
+        """The body decoded as json, or None if there's no body"""
+        if self._json is _UNDECODED:
+            if not self.body or self.body.isspace():
+                self._json = None
+            else:
+                self._json = decode_json(self.body)
+
+        return self._json
+
+    @property
+    def image(self):
+        """The raw bytes of an image"""
+        return self.body
+
+    @property
+    def plain_text(self):
+        """The raw body"""
+        return self.body
+
+
+def decode_json(body: bytes):
+    """Decode json with orjson if it's installed, or the standard library otherwise"""
+    if orjson:
+        return orjson.loads(body)
+
+    return json.loads(body)
+
+
+class ResponseCache():
+    """Keeps successful GET responses in memory and on disk
+
+    Responses that outlived their host's ttl are revalidated with the server
+    through ETag/Last-Modified before being reused.
+
+    Keywords:
+        max_entries::int
+            How many responses are kept in memory. Default is 256
+        max_age::int
+            Seconds after which a response is dropped from disk, even if it could be revalidated. Default is 7 days
+        ttl::dict
+            Seconds a response stays fresh, by host. Merged over DEFAULT_CACHE_TTL
+        max_disk_size::int
+            Bytes the responses on disk may take up before the oldest are dropped by sweep. Default is 256 MiB
+        sweep_interval::int
+            Seconds between sweeps of the responses on disk. Default is 1 hour
+        directory::str
+            Where the responses are stored on disk. Default is CACHE_DIR/http
+    """
+
+    def __init__(self, **kwargs):
+        self.max_entries = kwargs.get('max_entries', 256)
+        self.max_age = kwargs.get('max_age', 60 * 60 * 24 * 7)
+        self.max_disk_size = kwargs.get('max_disk_size', 256 * 1024 * 1024)
+        self.sweep_interval = kwargs.get('sweep_interval', 60 * 60)
+        self.ttl = dict(DEFAULT_CACHE_TTL)
+        self.ttl.update(kwargs.get('ttl', {}))
+        self.directory = kwargs.get('directory') or os.path.join(koabot.koakuma.CACHE_DIR, 'http')
+        self._entries = collections.OrderedDict()
+
+    def get_ttl(self, url: str):
+        """Get for how long responses from the host of an url stay fresh"""
+        return self.ttl.get(get_domain(url), 0)
+
+    @staticmethod
+    def make_key(method: str, url: str, **kwargs):
+        """Identify a request by its method, url, body and relevant headers
+        Keywords:
+            data
+                The body of the request
+            headers::dict
+                The headers of the request
+            auth::aiohttp.BasicAuth
+                Authentication object of the request
+        """
+        data = kwargs.get('data')
+        headers = kwargs.get('headers') or {}
+        auth = kwargs.get('auth')
+
+        if isinstance(data, dict):
+            data = sorted(data.items())
+
+        relevant_headers = sorted((k.lower(), v) for k, v in headers.items() if k.lower() in CACHE_KEY_HEADERS)
+        identity = repr((method, url, data, relevant_headers, auth and auth.encode()))
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    async def get(self, key: str):
+        """Get a cached entry, looking in memory first and on disk second"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        entry = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+
+        if entry:
+            self._remember(key, entry)
+
+        return entry
+
+    async def put(self, key: str, entry: dict):
+        """Store an entry in both tiers, renewing its age"""
+        entry['stored_at'] = time.time()
+        self._remember(key, entry)
+
+        # the response object only lives in memory, it's rebuilt when read from disk
+        await asyncio.get_running_loop().run_in_executor(None, self._write, key, {k: v for k, v in entry.items() if k != 'response'})
+
+    async def sweep(self):
+        """Drop the responses on disk that are older than max_age, then the oldest ones until they fit in max_disk_size
+        Returns:
+            int
+                How many responses were dropped
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self._sweep)
+
+    @staticmethod
+    def to_entry(net_response: NetResponse):
+        """Make a cacheable entry out of a response"""
+        headers = {k: v for k, v in net_response.headers.items() if k.lower() in CACHE_STORED_HEADERS}
+        return {'status': net_response.status, 'url': net_response.url, 'headers': headers, 'body': net_response.body, 'response': net_response}
+
+    @staticmethod
+    def to_response(entry: dict):
+        """Get the response of a cached entry, rebuilding it if it was read from disk"""
+        if 'response' not in entry:
+            entry['response'] = NetResponse(entry['status'], url=entry['url'], headers=entry['headers'], body=entry['body'])
+
+        return entry['response']
+
+    @staticmethod
+    def get_validators(entry: dict):
+        """Get the headers that make a request conditional to the cached entry"""
+        validators = {}
+
+        for k, v in entry['headers'].items():
+            if k.lower() == 'etag':
+                validators['If-None-Match'] = v
+            elif k.lower() == 'last-modified':
+                validators['If-Modified-Since'] = v
+
+        return validators
+
+    def _remember(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_path(self, key: str):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read(self, key: str):
+        """Read an entry from disk: its metadata from a json file and its body from a file of its own"""
+        file_path = self._get_path(key)
+
+        try:
+            with open(f'{file_path}.json', 'r', encoding='utf-8') as meta_file:
+                entry = json.load(meta_file)
+
+            if time.time() - entry['stored_at'] > self.max_age:
+                self._remove(file_path)
+                return None
+
+            with open(f'{file_path}.body', 'rb') as body_file:
+                entry['body'] = body_file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return entry
+
+    def _write(self, key: str, entry: dict):
+        file_path = self._get_path(key)
+        meta = {k: v for k, v in entry.items() if k != 'body'}
+
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            # the metadata goes last, an entry without it is never read
+            # both are written to temporary files first so that readers never see half of them
+            for suffix, mode, content in [('body', 'wb', entry['body']), ('json', 'w', json.dumps(meta))]:
+                tmp_path = f'{file_path}.{suffix}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+                with open(tmp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as cache_file:
+                    cache_file.write(content)
+
+                os.replace(tmp_path, f'{file_path}.{suffix}')
+        except OSError as e:
+            print(f'Could not cache response on disk: {e!r}')
+
+    @staticmethod
+    def _remove(file_path: str):
+        for suffix in ['json', 'body']:
+            with contextlib.suppress(OSError):
+                os.remove(f'{file_path}.{suffix}')
+
+    def _sweep(self):
+        now = time.time()
+        # path without its suffix -> [last modified, size, files]
+        entries = {}
+
+        for dir_path, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+
+                # leftovers of writes that never finished
+                if file_name.endswith('.tmp'):
+                    if now - stat.st_mtime > 60 * 60:
+                        with contextlib.suppress(OSError):
+                            os.remove(file_path)
+
+                    continue
+
+                entry = entries.setdefault(os.path.join(dir_path, file_name.split('.')[0]), [0, 0, []])
+                entry[0] = max(entry[0], stat.st_mtime)
+                entry[1] += stat.st_size
+                entry[2].append(file_path)
+
+        dropped = 0
+        total_size = sum(size for _, size, _ in entries.values())
+
+        # oldest first
+        for mtime, size, file_paths in sorted(entries.values()):
+            if now - mtime <= self.max_age and total_size <= self.max_disk_size:
+                break
+
+            for file_path in file_paths:
+                with contextlib.suppress(OSError):
+                    os.remove(file_path)
+
+            total_size -= size
+            dropped += 1
+
+        return dropped
 
 
 async def fetch_image(url: str, **kwargs):
-    """Download an image"""
+    """Download an image chunk by chunk, without ever holding all of it in memory
+    Arguments:
+        url::str
+            The url of the image
 
-    img_bytes = io.BytesIO((await http_request(url, image=True, **kwargs)).image)
-    return img_bytes
+    Keywords:
+        headers::json object
+            object containing headers
+        cache_path::str
+            Save the image at this path. It is only put in place once the download is complete.
+        max_size::int
+            Abort the download if the image is bigger than this many bytes. Default is the session manager's max_image_size
+
+    Returns:
+        A file object at position 0 that discord.File can read, or None if the download failed or was too big
+    """
+    headers = kwargs.get('headers')
+    cache_path = kwargs.get('cache_path')
+
+    manager = get_session_manager()
+    max_size = kwargs.get('max_size', manager.max_image_size)
+
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        image_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), prefix='.', suffix='.tmp', delete=False)
+    else:
+        # small images never leave memory, big ones spill over to disk
+        image_file = tempfile.SpooledTemporaryFile(max_size=manager.image_spool_size)
+
+    def discard_download(reason: str):
+        print(f'> {datetime.now()}\nFailed downloading {url}\n{reason}')
+        image_file.close()
+
+        if cache_path:
+            os.remove(image_file.name)
+
+    try:
+        async with _open_request('GET', url, headers=headers) as response:
+            if response.status != 200:
+                discard_download(f'[Network status {response.status}]: {response.reason}')
+                return None
+
+            if response.content_length and response.content_length > max_size:
+                discard_download(f'Image is {response.content_length} bytes, over the limit of {max_size}')
+                return None
+
+            # streamed chunks don't go through the trace that counts what .read() receives
+            host_stats = manager.stats.get(get_domain(url))
+            downloaded_size = 0
+            async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                downloaded_size += len(chunk)
+                host_stats.bytes_in += len(chunk)
+
+                if downloaded_size > max_size:
+                    discard_download(f'Image is over the limit of {max_size} bytes')
+                    return None
+
+                image_file.write(chunk)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        discard_download(repr(e))
+        return None
+    except BaseException:
+        discard_download('Download interrupted')
+        raise
+
+    if cache_path:
+        image_file.close()
+        os.replace(image_file.name, cache_path)
+        return open(cache_path, 'rb')
+
+    image_file.seek(0)
+    return image_file
+
+
+def parse_retry_after(value: str):
+    """Get the seconds to wait from a Retry-After header, given either in seconds or as a date"""
+    if not value:
+        return None
+
+    if value.isdigit():
+        return int(value)
+
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0, retry_date.timestamp() - time.time())
 
 
 def get_url_filename(url: str):
@@ -95,9 +989,36 @@ def get_url_fileext(url: str):
     return get_url_filename(url).split('.')[-1].split('?')[0]
 
 
+def load_suffix_list(suffix_list: str = None):
+    """Load the public suffix list used to tell domains apart, without touching the network
+    Arguments:
+        suffix_list::str
+            Path to a copy of the public suffix list. Default is the snapshot bundled with tldextract
+    """
+    global _tld_extractor
+
+    suffix_list_urls = (f'file://{os.path.abspath(suffix_list)}',) if suffix_list else ()
+    _tld_extractor = tldextract.TLDExtract(cache_dir=None, suffix_list_urls=suffix_list_urls, fallback_to_snapshot=True)
+    # the list is only read on the first extraction
+    _tld_extractor('example.com')
+    _extract_fqdn.cache_clear()
+
+
+@functools.lru_cache(maxsize=1024)
+def _extract_fqdn(hostname: str):
+    if not _tld_extractor:
+        load_suffix_list()
+
+    # hosts without a known suffix, like ips, are their own domain
+    return _tld_extractor(hostname).fqdn or hostname
+
+
 def get_domain(url: str):
-    """Get domain from an url"""
-    return url.split('//')[-1].split('/')[0].split('?')[0]
+    """Get the fully qualified domain name of an url"""
+    if '//' not in url:
+        url = f'//{url}'
+
+    return _extract_fqdn(urllib.parse.urlsplit(url).hostname or '')
 
 
 def get_domains(lst: list):
@@ -0,0 +1,58 @@
+"""Keep the replies of concurrent tasks in order"""
+import asyncio
+
+
+class OrderedSends():
+    """Lets several tasks reply to the same message at once while their replies still show up in order
+
+    Every task is given a slot. Whatever a slot sends is held back until
+    every earlier slot is finished, so replies come out in slot order no
+    matter which task is done first.
+
+    Arguments:
+        size::int
+            Amount of slots
+    """
+
+    def __init__(self, size: int):
+        self.finished = [asyncio.Event() for _ in range(size)]
+
+    async def wait_turn(self, slot: int):
+        """Wait until every slot before the given one is finished"""
+        for event in self.finished[:slot]:
+            await event.wait()
+
+    def finish(self, slot: int):
+        """Mark a slot as finished, letting the next ones send"""
+        self.finished[slot].set()
+
+    def wrap(self, msg, slot: int):
+        """Get a stand-in for a message whose channel sends through the given slot"""
+        return OrderedMessage(msg, OrderedChannel(msg.channel, self, slot))
+
+
+class OrderedChannel():
+    """Proxy to a channel that waits for its turn before sending"""
+
+    def __init__(self, channel, sends: OrderedSends, slot: int):
+        self._channel = channel
+        self._sends = sends
+        self._slot = slot
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    async def send(self, *args, **kwargs):
+        await self._sends.wait_turn(self._slot)
+        return await self._channel.send(*args, **kwargs)
+
+
+class OrderedMessage():
+    """Proxy to a message whose channel is an OrderedChannel"""
+
+    def __init__(self, msg, channel: OrderedChannel):
+        self._msg = msg
+        self.channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self._msg, name)
@@ -1,5 +1,7 @@
 """Post utilities"""
+import collections
 import re
+import time
 import typing
 
 import koabot.koakuma
@@ -83,3 +85,74 @@ def post_is_missing_preview(post, **kwargs):
         return True
 
     return koabot.koakuma.list_contains(post['tag_string_general'].split(), koabot.koakuma.bot.rules['no_preview_tags'][board]) or post['is_banned']
+
+
+class RecentPosts():
+    """Remembers which posts were previewed in each channel a short while ago
+
+    Posts are told apart by channel, board and post id. Each channel keeps
+    its most recent posts only, dropping the least recently seen ones first.
+
+    Keywords:
+        ttl::float
+            Seconds a preview is remembered for. Default is 600
+        max_per_channel::int
+            Most posts remembered for a single channel. Default is 50
+        max_channels::int
+            Most channels remembered at once. Default is 1000
+    """
+
+    def __init__(self, **kwargs):
+        self.ttl = kwargs.get('ttl', 600)
+        self.max_per_channel = kwargs.get('max_per_channel', 50)
+        self.max_channels = kwargs.get('max_channels', 1000)
+
+        # channel id -> (board, post id) -> (time it was seen, link to where it was previewed)
+        self.channels = collections.OrderedDict()
+
+    def find(self, channel_id: int, board: str, post_id):
+        """Get the link to where a post was previewed in a channel a short while ago
+        Returns:
+            str
+                The link to the preview, or None if there wasn't one
+        """
+        posts = self.channels.get(channel_id)
+
+        if not posts:
+            return None
+
+        key = (board.lower(), str(post_id))
+
+        if key not in posts:
+            return None
+
+        seen_at, jump_url = posts[key]
+
+        if time.monotonic() - seen_at >= self.ttl:
+            del posts[key]
+            return None
+
+        return jump_url
+
+    def remember(self, channel_id: int, board: str, post_id, jump_url: str):
+        """Take note that a post was just previewed in a channel
+        Arguments:
+            jump_url::str
+                Link to the preview
+        """
+        key = (board.lower(), str(post_id))
+
+        if channel_id in self.channels:
+            self.channels.move_to_end(channel_id)
+            posts = self.channels[channel_id]
+        else:
+            posts = self.channels[channel_id] = collections.OrderedDict()
+
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+
+        posts[key] = (time.monotonic(), jump_url)
+        posts.move_to_end(key)
+
+        if len(posts) > self.max_per_channel:
+            posts.popitem(last=False)
@@ -0,0 +1,161 @@
+"""Rate limiting utilities"""
+import asyncio
+import collections
+import time
+
+
+class TokenBucket():
+    """Lets through bursts of up to `capacity` actions, refilling at `rate` actions per second
+
+    Actions over the limit aren't refused, they are given a place in line
+    and told how long to wait for their turn.
+
+    Arguments:
+        rate::float
+            Tokens refilled per second
+        capacity::float
+            Most tokens the bucket can hold
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self):
+        """Add the tokens earned since the last time the bucket was used"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return now
+
+    def reserve(self):
+        """Take a token, borrowing it from the future if there are none left
+        Returns:
+            float
+                Seconds to wait before the token can be used
+        """
+        now = self.refill()
+        self.tokens -= 1
+
+        wait = max(0, self.blocked_until - now)
+
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+
+        return wait
+
+    def take(self, cost: float = 1):
+        """Take tokens only if there are enough of them
+        Returns:
+            bool
+                Whether or not they were taken
+        """
+        self.refill()
+
+        if self.tokens < cost:
+            return False
+
+        self.tokens -= cost
+        return True
+
+    def refund(self):
+        """Give back a token that was reserved but never used"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def block(self, seconds: float):
+        """Hold every token back for the given amount of seconds"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        wait = self.reserve()
+
+        if wait:
+            await asyncio.sleep(wait)
+
+        return wait
+
+
+class RateLimitStore():
+    """A token bucket for each key, like a user id, that refuses actions over the limit
+
+    Keys that haven't been seen for `ttl` seconds are forgotten, and so are
+    the least recently seen ones once there are more than `max_entries`.
+    With the default ttl a key is only forgotten once its bucket is full
+    again, so forgetting it changes nothing.
+
+    Arguments:
+        rate::float
+            Tokens refilled per second
+        capacity::float
+            Most tokens a bucket can hold
+
+    Keywords:
+        ttl::float
+            Seconds an idle key is kept. Default is the time an empty bucket takes to fill up
+        max_entries::int
+            Most keys kept at once. Default is 10000
+    """
+
+    def __init__(self, rate: float, capacity: float, **kwargs):
+        self.rate = rate
+        self.capacity = capacity
+        self.ttl = kwargs.get('ttl', capacity / rate)
+        self.max_entries = kwargs.get('max_entries', 10000)
+
+        # key -> bucket, from least to most recently used
+        self.buckets = collections.OrderedDict()
+
+        self.allowed = 0
+        self.refused = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def acquire(self, key, cost: float = 1):
+        """Take tokens from the bucket of a key
+        Returns:
+            bool
+                False if the key is over the limit
+        """
+        bucket = self.buckets.get(key)
+
+        if bucket:
+            self.buckets.move_to_end(key)
+        else:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+
+        allowed = bucket.take(cost)
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.refused += 1
+
+        self.evict()
+        return allowed
+
+    def evict(self):
+        """Forget the keys that have been idle for too long, and the oldest ones if there are too many"""
+        now = time.monotonic()
+
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+
+            if now - bucket.updated_at >= self.ttl:
+                self.expired += 1
+            elif len(self.buckets) > self.max_entries:
+                self.evicted += 1
+            else:
+                break
+
+            del self.buckets[key]
+
+    def summary(self):
+        """Get a human readable line of how full the store is"""
+        return f'{len(self)}/{self.max_entries} keys, {self.allowed} allowed, {self.refused} refused, {self.expired} expired, {self.evicted} evicted'
@@ -0,0 +1,216 @@
+"""Store the reaction role bindings in the database"""
+import collections
+import json
+import os
+import time
+
+
+class ReactionRoleBinds():
+    """The reaction role bindings of every message, read from the database as they're needed
+
+    Works like a dict of message id (str) -> {'channel_id', 'links'}, where
+    every link is {'reactions': set of emojis, 'roles': list of role ids}.
+    Only the ids of the bound messages are read up front, the links of a
+    message are read the first time they're asked for.
+
+    The database lives in the cache directory. export_json writes every
+    binding to a file in the format of the old binds.json, which
+    import_json can read back into an empty database.
+
+    Arguments:
+        conn::sqlite3.Connection
+            Database with the reactionRole tables of db/database.sql
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.bindings = {}
+        # (message id, emoji, user id) -> whether the reaction was added, until flush_snapshot writes them
+        self.seen_changes = {}
+
+        c = self.conn.cursor()
+        c.execute('SELECT messageDId FROM reactionRoleBinding')
+        self.message_ids = {str(row[0]) for row in c.fetchall()}
+        c.close()
+
+    def __contains__(self, message_id):
+        return str(message_id) in self.message_ids
+
+    def __iter__(self):
+        return iter(list(self.message_ids))
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    def __getitem__(self, message_id):
+        message_id = str(message_id)
+
+        if message_id not in self.message_ids:
+            raise KeyError(message_id)
+
+        if message_id not in self.bindings:
+            self.bindings[message_id] = self.load(message_id)
+
+        return self.bindings[message_id]
+
+    def items(self):
+        for message_id in self:
+            yield message_id, self[message_id]
+
+    def load(self, message_id: str):
+        """Read the binding of a message from the database"""
+        c = self.conn.cursor()
+
+        c.execute('SELECT channelDId FROM reactionRoleBinding WHERE messageDId = ?', (int(message_id),))
+        channel_id = c.fetchone()[0]
+
+        links = {}
+        c.execute('SELECT linkId FROM reactionRoleLink WHERE messageDId = ? ORDER BY linkId', (int(message_id),))
+        for (link_id,) in c.fetchall():
+            links[link_id] = {'reactions': set(), 'roles': []}
+
+        c.execute('SELECT r.linkId, r.emoji FROM reactionRoleReaction AS r, reactionRoleLink AS l WHERE r.linkId = l.linkId AND l.messageDId = ?', (int(message_id),))
+        for link_id, em in c.fetchall():
+            links[link_id]['reactions'].add(em)
+
+        c.execute('SELECT r.linkId, r.roleDId FROM reactionRoleRole AS r, reactionRoleLink AS l WHERE r.linkId = l.linkId AND l.messageDId = ?', (int(message_id),))
+        for link_id, role_id in c.fetchall():
+            links[link_id]['roles'].append(role_id)
+
+        c.close()
+        return {'channel_id': str(channel_id), 'links': list(links.values())}
+
+    def save(self, message_id, channel_id, links: list):
+        """Bind a message, replacing whatever it was bound to before
+        Arguments:
+            message_id::str or int
+            channel_id::str or int
+            links::list
+                Every link has the 'reactions' to react with and the 'roles' (discord.Role or id) they give
+        """
+        message_id = str(message_id)
+
+        self.forget_seen_changes(message_id)
+
+        with self.conn:
+            self.delete_rows(message_id)
+            self.conn.execute('INSERT INTO reactionRoleBinding (messageDId, channelDId) VALUES (?, ?)', (int(message_id), int(channel_id)))
+
+            for link in links:
+                c = self.conn.execute('INSERT INTO reactionRoleLink (messageDId) VALUES (?)', (int(message_id),))
+                link_id = c.lastrowid
+
+                self.conn.executemany('INSERT OR IGNORE INTO reactionRoleReaction (linkId, emoji) VALUES (?, ?)', [(link_id, em) for em in link['reactions']])
+                self.conn.executemany('INSERT OR IGNORE INTO reactionRoleRole (linkId, roleDId) VALUES (?, ?)', [(link_id, getattr(r, 'id', r)) for r in link['roles']])
+
+        self.message_ids.add(message_id)
+        self.bindings[message_id] = {'channel_id': str(channel_id), 'links': links}
+
+    def get_snapshot(self, message_id):
+        """Get the reactions last seen on a message, as emoji -> set of user ids
+        Returns None if they were never taken note of.
+        """
+        c = self.conn.cursor()
+        c.execute('SELECT 1 FROM reactionRoleSnapshot WHERE messageDId = ?', (int(message_id),))
+
+        if not c.fetchone():
+            c.close()
+            return None
+
+        reactions = collections.defaultdict(set)
+        c.execute('SELECT emoji, userDId FROM reactionRoleSeen WHERE messageDId = ?', (int(message_id),))
+        for em, user_id in c.fetchall():
+            reactions[em].add(user_id)
+
+        c.close()
+        return reactions
+
+    def save_snapshot(self, message_id, reactions: dict):
+        """Take note of every reaction on a message, replacing what was seen before
+        Arguments:
+            reactions::dict
+                emoji -> user ids
+        """
+        self.forget_seen_changes(message_id)
+
+        with self.conn:
+            self.conn.execute('DELETE FROM reactionRoleSeen WHERE messageDId = ?', (int(message_id),))
+            self.conn.execute('INSERT OR REPLACE INTO reactionRoleSnapshot (messageDId, takenAt) VALUES (?, ?)', (int(message_id), time.time()))
+            self.conn.executemany('INSERT INTO reactionRoleSeen (messageDId, emoji, userDId) VALUES (?, ?, ?)', [(int(message_id), em, user_id) for em, user_ids in reactions.items() for user_id in user_ids])
+
+    def snapshot_reaction(self, message_id, em: str, user_id: int, added: bool):
+        """Take note of a single reaction being added or removed
+        Nothing is written until flush_snapshot is called.
+        """
+        self.seen_changes[(int(message_id), em, user_id)] = added
+
+    def flush_snapshot(self):
+        """Write every reaction change taken note of since the last flush, in one transaction"""
+        if not self.seen_changes:
+            return
+
+        seen_changes, self.seen_changes = self.seen_changes, {}
+
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO reactionRoleSeen (messageDId, emoji, userDId) VALUES (?, ?, ?)', [k for k, added in seen_changes.items() if added])
+            self.conn.executemany('DELETE FROM reactionRoleSeen WHERE messageDId = ? AND emoji = ? AND userDId = ?', [k for k, added in seen_changes.items() if not added])
+
+    def clear_snapshot(self, message_id, em: str = None):
+        """Take note of the reactions of a message being cleared, all of them or just those of an emoji"""
+        self.forget_seen_changes(message_id, em)
+
+        with self.conn:
+            if em:
+                self.conn.execute('DELETE FROM reactionRoleSeen WHERE messageDId = ? AND emoji = ?', (int(message_id), em))
+            else:
+                self.conn.execute('DELETE FROM reactionRoleSeen WHERE messageDId = ?', (int(message_id),))
+
+    def forget_seen_changes(self, message_id, em: str = None):
+        """Drop the unwritten reaction changes of a message, all of them or just those of an emoji"""
+        for key in [k for k in self.seen_changes if k[0] == int(message_id) and em in (None, k[1])]:
+            del self.seen_changes[key]
+
+    def delete_rows(self, message_id: str):
+        link_ids = 'SELECT linkId FROM reactionRoleLink WHERE messageDId = ?'
+        self.conn.execute(f'DELETE FROM reactionRoleReaction WHERE linkId IN ({link_ids})', (int(message_id),))
+        self.conn.execute(f'DELETE FROM reactionRoleRole WHERE linkId IN ({link_ids})', (int(message_id),))
+        self.conn.execute('DELETE FROM reactionRoleLink WHERE messageDId = ?', (int(message_id),))
+        self.conn.execute('DELETE FROM reactionRoleSeen WHERE messageDId = ?', (int(message_id),))
+        self.conn.execute('DELETE FROM reactionRoleSnapshot WHERE messageDId = ?', (int(message_id),))
+        self.conn.execute('DELETE FROM reactionRoleBinding WHERE messageDId = ?', (int(message_id),))
+
+    def export_json(self, file_path: str):
+        """Write every binding to a file in the format of the old binds.json
+        Returns:
+            int
+                How many bindings were written
+        """
+        j_data = {}
+        for message_id, binding in sorted(self.items()):
+            j_data[message_id] = {
+                'channel_id': binding['channel_id'],
+                'links': [{'reactions': sorted(link['reactions']), 'roles': [getattr(r, 'id', r) for r in link['roles']]} for link in binding['links']]
+            }
+
+        # replace the file in one go so that it's never left half written
+        with open(f'{file_path}.tmp', 'w', encoding='utf-8') as json_file:
+            json.dump(j_data, json_file, indent=4)
+
+        os.replace(f'{file_path}.tmp', file_path)
+        return len(j_data)
+
+    def import_json(self, file_path: str):
+        """Read the bindings of a binds.json into the database, if the database has none
+        This takes in the old binds.json once, and a file from export_json if the database was lost.
+        The file is only read.
+        """
+        if self.message_ids or not os.path.isfile(file_path):
+            return
+
+        with open(file_path, 'r', encoding='utf-8') as json_file:
+            j_data = json.load(json_file)
+
+        for message_id, v in j_data.items():
+            self.save(message_id, v['channel_id'], [{'reactions': set(link['reactions']), 'roles': list(link['roles'])} for link in v['links']])
+
+        print(f'Imported {len(j_data)} reaction role bindings from {file_path}')
@@ -0,0 +1,87 @@
+"""Keep track of the reactions on the messages the bot watches"""
+import asyncio
+import collections
+
+
+class ReactionIndex():
+    """Who reacted with what on every watched message, kept in memory
+
+    A message is read from Discord once, when it's first needed, and is
+    kept up to date with the reaction events from then on. Asking what a
+    user reacted with takes no requests at all.
+    """
+
+    def __init__(self):
+        # message id -> emoji -> ids of the users that reacted with it
+        self.messages = {}
+        # message id -> the task reading it from Discord
+        self.seeding = {}
+
+    async def seed(self, channel, message_id: int, emojis):
+        """Read the reactions of a message from Discord, replacing whatever was known about it
+        Arguments:
+            channel::discord.TextChannel
+            message_id::int
+            emojis::set
+                The emojis worth keeping track of
+        """
+        message = await channel.fetch_message(message_id)
+        reactions = collections.defaultdict(set)
+
+        for reaction in message.reactions:
+            em = str(reaction.emoji)
+
+            if em not in emojis:
+                continue
+
+            # users come in pages of 100
+            async for user in reaction.users(limit=None):
+                reactions[em].add(user.id)
+
+        self.messages[message_id] = reactions
+
+    async def ensure(self, channel, message_id: int, emojis):
+        """Make sure a message has been read from Discord, reading it if it wasn't"""
+        if message_id in self.messages:
+            return
+
+        if message_id not in self.seeding:
+            self.seeding[message_id] = asyncio.ensure_future(self.seed(channel, message_id, emojis))
+
+        try:
+            await asyncio.shield(self.seeding[message_id])
+        finally:
+            if self.seeding.get(message_id) and self.seeding[message_id].done():
+                self.seeding.pop(message_id)
+
+    async def refresh(self, channel, message_id: int, emojis):
+        """Read a message from Discord again, holding back its reaction events until it's done"""
+        self.forget(message_id)
+        await self.ensure(channel, message_id, emojis)
+
+    def forget(self, message_id: int):
+        """Drop what's known about a message, so that it's read again the next time it's needed"""
+        self.messages.pop(message_id, None)
+
+    def add(self, message_id: int, em: str, user_id: int):
+        if message_id in self.messages:
+            self.messages[message_id][em].add(user_id)
+
+    def remove(self, message_id: int, em: str, user_id: int):
+        if message_id in self.messages:
+            self.messages[message_id][em].discard(user_id)
+
+    def clear(self, message_id: int, em: str = None):
+        """Forget the reactions of a message that were cleared, all of them or just those of an emoji"""
+        if message_id not in self.messages:
+            return
+
+        if em:
+            self.messages[message_id].pop(em, None)
+        else:
+            self.messages[message_id].clear()
+
+    def get_user_reactions(self, message_id: int, user_id: int, emojis):
+        """Get which of the given emojis a user reacted with on a message"""
+        reactions = self.messages.get(message_id, {})
+        return [em for em in emojis if user_id in reactions.get(em, ())]
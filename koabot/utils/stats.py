@@ -0,0 +1,143 @@
+"""Counters and histograms to keep track of how the bot performs"""
+import bisect
+import collections
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class Histogram():
+    """Counts observations into cumulative buckets, like Prometheus does
+    Arguments:
+        buckets::list
+            Sorted upper bounds of the buckets. Default is LATENCY_BUCKETS
+    """
+
+    def __init__(self, buckets: list = None):
+        self.buckets = buckets or LATENCY_BUCKETS
+        # the last slot holds everything over the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value: float):
+        """Add an observation"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """Get the upper bound of the bucket the given quantile falls in"""
+        if not self.count:
+            return 0
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+        return float('inf')
+
+    def to_prometheus(self, name: str, labels: str = ''):
+        """Get the lines of this histogram in the Prometheus text format"""
+        lines = []
+        cumulative = 0
+        bucket_labels = f'{labels},' if labels else ''
+        labels = f'{{{labels}}}' if labels else ''
+
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{bucket_labels}le="{bound}"}} {cumulative}')
+
+        lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{labels} {self.sum:0.6f}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+
+class HostStats():
+    """Everything measured about the requests made to a single host"""
+
+    # counters that are reported as they are
+    COUNTERS = ['requests', 'errors', 'bytes_in', 'bytes_out', 'cache_hits', 'revalidations', 'coalesced', 'circuit_trips', 'circuit_rejections']
+
+    # latencies, measured in seconds
+    HISTOGRAMS = ['connect', 'ttfb', 'total']
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+        self.revalidations = 0
+        self.coalesced = 0
+        self.circuit_trips = 0
+        self.circuit_rejections = 0
+
+        self.connect = Histogram()
+        self.ttfb = Histogram()
+        self.total = Histogram()
+
+        self.statuses = collections.Counter()
+        self.circuit_state = 'closed'
+
+    def update_circuit(self, breaker):
+        """Take the state of the host's circuit breaker"""
+        self.circuit_state = breaker.state
+        self.circuit_trips = breaker.trips
+        self.circuit_rejections = breaker.rejections
+
+
+class NetStats():
+    """Network statistics, by host"""
+
+    def __init__(self):
+        self.hosts = collections.defaultdict(HostStats)
+
+    def get(self, host: str) -> HostStats:
+        """Get the statistics of a host"""
+        return self.hosts[host]
+
+    def summary(self):
+        """Get a human readable table of the busiest hosts"""
+        lines = [f"{'host':<28}{'reqs':>6}{'2xx':>6}{'4xx':>5}{'5xx':>5}{'err':>5}{'hits':>6}{'coal':>6}{'KiB in':>8}{'ttfb p50':>10}{'total p95':>11}  circuit"]
+
+        for host, stats in sorted(self.hosts.items(), key=lambda item: item[1].requests, reverse=True):
+            status_groups = collections.Counter()
+            for status, count in stats.statuses.items():
+                status_groups[status // 100] += count
+
+            lines.append(
+                f'{host[:27]:<28}{stats.requests:>6}{status_groups[2]:>6}{status_groups[4]:>5}{status_groups[5]:>5}{stats.errors:>5}'
+                f'{stats.cache_hits:>6}{stats.coalesced:>6}{stats.bytes_in / 1024:>8.0f}'
+                f'{stats.ttfb.quantile(0.5) * 1000:>8.0f}ms{stats.total.quantile(0.95) * 1000:>9.0f}ms  {stats.circuit_state}')
+
+        return '\n'.join(lines)
+
+    def to_prometheus(self, prefix: str = 'koabot_http'):
+        """Get every statistic in the Prometheus text format"""
+        lines = []
+
+        for counter in HostStats.COUNTERS:
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            for host, stats in self.hosts.items():
+                lines.append(f'{prefix}_{counter}_total{{host="{host}"}} {getattr(stats, counter)}')
+
+        lines.append(f'# TYPE {prefix}_responses_total counter')
+        for host, stats in self.hosts.items():
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'{prefix}_responses_total{{host="{host}",status="{status}"}} {count}')
+
+        lines.append(f'# TYPE {prefix}_circuit_open gauge')
+        for host, stats in self.hosts.items():
+            lines.append(f'{prefix}_circuit_open{{host="{host}"}} {int(stats.circuit_state != "closed")}')
+
+        for histogram in HostStats.HISTOGRAMS:
+            lines.append(f'# TYPE {prefix}_{histogram}_seconds histogram')
+            for host, stats in self.hosts.items():
+                lines.extend(getattr(stats, histogram).to_prometheus(f'{prefix}_{histogram}_seconds', f'host="{host}"'))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,71 @@
+"""Url utilities"""
+import re
+
+from koabot.patterns import URL_PATTERN
+
+
+def extract_urls(content: str):
+    """Find every url in a message, in a single pass
+    Urls wrapped in angle brackets, which Discord doesn't embed, are left out.
+
+    Returns:
+        list
+            The urls, in the order they appear
+    """
+    urls = []
+
+    for url_match in URL_PATTERN.finditer(content):
+        start, end = url_match.span()
+
+        if 0 < start and content[start - 1] == '<' and end < len(content) and content[end] == '>':
+            continue
+
+        urls.append(url_match.group())
+
+    return urls
+
+
+class DomainDispatcher():
+    """Tells which match group a domain belongs to with a single regex match
+
+    Every url pattern of the match groups is compiled into one regex, each
+    pattern in a named group of its own. Alternatives are tried in the
+    order they were given, so the first pattern that matches wins, and as
+    with re.match() they only need to match from the start of the domain.
+
+    Arguments:
+        match_groups::dict
+            The match groups of the config, by group name
+    """
+
+    def __init__(self, match_groups: dict):
+        self.entries = []
+        alternatives = []
+
+        for group, contents in match_groups.items():
+            for match in contents:
+                alternatives.append(f'(?P<_{len(self.entries)}>{self.to_pattern(match["url"])})')
+                self.entries.append((group, match['guide']))
+
+        self.pattern = re.compile('|'.join(alternatives)) if alternatives else None
+
+    @staticmethod
+    def to_pattern(url: str):
+        """Turn a url of the match groups, which may have * wildcards, into a regex"""
+        return url.replace('.', r'\.').replace('*', '(?:.*?)')
+
+    def resolve(self, fqdn: str):
+        """Find the match group of a domain
+        Returns:
+            tuple
+                The name of the group and its guides, or None if no group matches
+        """
+        if not self.pattern:
+            return None
+
+        match = self.pattern.match(fqdn)
+
+        if not match:
+            return None
+
+        return self.entries[int(match.lastgroup[1:])]